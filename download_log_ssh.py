@@ -1,9 +1,11 @@
+import configparser
 import logging
 import os
-import google.auth
-from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
-from retry import retry
+from utils.config_log import CONFIG_PATH
+from utils.quota import QuotaScheduler
+from utils.drive_uploader import DriveUploader
+import utils.google_clients as google_clients
 
 # 設定日誌
 log_directory = 'logs'
@@ -21,23 +23,19 @@ logging.basicConfig(level=logging.INFO,
 
 # 設定 Google Drive API
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
-creds, _ = google.auth.load_credentials_from_file('cred.json', scopes=SCOPES)
+drive_service = google_clients.drive(SCOPES)
 
-drive_service = build('drive', 'v3', credentials=creds)
+# 只讀設定檔的 [quota]，config.ini 不存在時使用預設額度
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+quota = QuotaScheduler.from_config(config)
+drive_uploader = DriveUploader(drive_service, quota=quota)
+drive_uploader.start()
 
-@retry(tries=5, delay=2, backoff=2)
 def upload_to_drive(file_path, file_name):
     try:
-        file_metadata = {'name': file_name}
-        media = MediaFileUpload(file_path, mimetype='text/plain', resumable=True)
-        file = drive_service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-
-        # 取得公開連結
-        file_id = file.get('id')
-        drive_service.permissions().create(fileId=file_id, body={'type': 'anyone', 'role': 'reader'}).execute()
-        link = f"https://drive.google.com/file/d/{file_id}/view"
-        logging.info(f"File uploaded successfully: {link}")
-        return link
+        # 檔案在上傳的 worker 中才打開，分享與其他待上傳的檔案合併成一次 batch
+        return drive_uploader.upload(file_name, lambda: MediaFileUpload(file_path, mimetype='text/plain', resumable=True)).result()
     except Exception as e:
         logging.error(f"Failed to upload to drive: {e}")
         raise e
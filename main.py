@@ -5,8 +5,7 @@ from selenium.webdriver.chrome.options import Options
 from webdriver_manager.chrome import ChromeDriverManager
 import pandas as pd
 from datetime import datetime
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import utils.google_clients as google_clients
 from googleapiclient.http import MediaIoBaseUpload
 import io, time, openpyxl
 from openpyxl.styles import Side, Border
@@ -99,13 +98,7 @@ combined_data["連續買 / 賣超"] = temp_num.apply(process_stock_code)
 driver.quit()
 
 def upload_to_drive(file_content):
-    SCOPES = ['https://www.googleapis.com/auth/drive.file']
-    SERVICE_ACCOUNT_FILE = 'cred.json'
-
-    credentials = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-
-    drive_service = build('drive', 'v3', credentials=credentials)
+    drive_service = google_clients.drive()
 
     file_metadata = {
         'name': 'data.xlsx',
@@ -219,13 +212,7 @@ output.seek(0)
 drive_link = upload_to_drive(output)
 
 def update_google_sheet(date, link):
-    SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-    SERVICE_ACCOUNT_FILE = 'cred.json'
-
-    credentials = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-
-    sheets_service = build('sheets', 'v4', credentials=credentials)
+    sheets_service = google_clients.sheets()
     spreadsheet_id = '1ZNCRPM9N6qZBSPvP_ggou91xHjWxfM53MjfvlXEaweg'
     range_name = 'A:B'
     
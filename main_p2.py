@@ -1,16 +1,25 @@
 import logging
-from flask import Flask, request, abort
+from flask import Flask, Response, request, abort
 from linebot import LineBotApi, WebhookHandler
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import MessageEvent, TextMessage, FileMessage
-import datetime, os, re
-import google.auth
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
-import threading
-import queue
+import datetime, os, re, unicodedata
+import utils.google_clients as google_clients
 from retry import retry
-import utils.gemini_tem as gemi
+import utils.llm_router as llm
+from utils.memo_store import MemoStore
+from utils.sheets_mirror import SheetsMirror
+from utils.task_executor import PartitionedExecutor
+from utils.task_journal import TaskJournal
+from utils.readiness import MemoReadiness
+from utils.drive_stream import StreamingMediaUpload
+from utils.drive_uploader import DriveUploader
+from utils.disk_cache import DiskCache
+from utils.metrics import registry, RetryCounter
+from utils.profiler import SamplingProfiler
+from utils.quota import QuotaScheduler
+from utils.gemini_tem import llm_cache
+import utils.weaviate_op as weaviate_op
 import pytz, time
 
 app = Flask(__name__)
@@ -27,11 +36,10 @@ handler = WebhookHandler(LINE_CHANNEL_SECRET)
 
 # 設定 Google Drive API 和 Google Sheets API
 SCOPES = ['https://www.googleapis.com/auth/drive.file', 'https://www.googleapis.com/auth/spreadsheets']
-creds, _ = google.auth.load_credentials_from_file('cred.json', scopes=SCOPES)
-
-drive_service = build('drive', 'v3', credentials=creds)
-sheets_service = build('sheets', 'v4', credentials=creds)
+drive_service = google_clients.drive(SCOPES)
+sheets_service = google_clients.sheets(SCOPES)
 spreadsheet_id = config.get("line", 'sheet_id')
+LINE_CHUNK_SIZE = 256 * 1024
 
 # 設定日誌
 log_directory = 'logs'
@@ -47,19 +55,158 @@ logging.basicConfig(level=logging.INFO,
                         logging.StreamHandler()
                     ])
 
-# 創建任務佇列
-task_queue = queue.Queue()
-
-def process_queue():
-    while True:
-        task = task_queue.get()
+# 各階段耗時與計數，由 /metrics/<secret_key> 以 Prometheus text format 輸出
+STAGE_SECONDS = registry.histogram("memobot_stage_seconds", "Time spent in each webhook pipeline stage")
+QUEUE_WAIT_SECONDS = registry.histogram("memobot_queue_wait_seconds", "Time a task waits before a worker starts it")
+SHEETS_SECONDS = registry.histogram("memobot_sheets_request_seconds", "Google Sheets API request latency")
+EVENTS = registry.counter("memobot_events_total", "Webhook events and tasks")
+RETRIES = registry.counter("memobot_retries_total", "Retries performed by @retry")
+logging.getLogger('retry.api').addHandler(RetryCounter(RETRIES))
+
+# Sheets / Drive 呼叫先取得 token 才送出，超過每分鐘額度時平均排開而不是撞 429 再重試
+quota = QuotaScheduler.from_config(config)
+
+# 本地 memo 主儲存，Google Sheets 由背景執行緒非同步鏡像
+memo_store = MemoStore(config.get("store", 'path'))
+sheets_mirror = SheetsMirror(
+    memo_store, sheets_service, spreadsheet_id,
+    window=config.getfloat("store", 'mirror_window', fallback=0.5),
+    max_batch=config.getint("store", 'mirror_batch', fallback=100),
+    quota=quota,
+    max_attempts=config.getint("store", 'mirror_max_attempts', fallback=5)
+)
+
+def log_mirror_result(memo_id, op, ok, error):
+    if not ok:
+        logging.error(f"Failed to mirror {op} of memo {memo_id}: {error}")
+
+sheets_mirror.result_listeners.append(log_mirror_result)
+sheets_mirror.timing_listeners.append(lambda name, seconds: SHEETS_SECONDS.observe(seconds, request=name))
+sheets_mirror.bootstrap()
+sheets_mirror.start()
+
+# 創建任務佇列，依 user_id 分片給多個 worker，同一使用者的任務維持先後順序
+task_queue = PartitionedExecutor(config.getint("queue", 'workers', fallback=4))
+
+# 任務先寫入磁碟上的日誌，完成後才 ack，重啟時會重新執行尚未完成的任務
+task_journal = TaskJournal(config.get("queue", 'journal', fallback='data/tasks.journal'))
+
+# 檔案傳輸 (LINE -> Drive) 有獨立的並行上限，不佔用 webhook 執行緒；上傳完成的檔案合併成一次 batch 開放分享
+drive_uploader = DriveUploader(
+    drive_service, quota=quota,
+    workers=config.getint("queue", 'download_workers', fallback=2),
+    window=config.getfloat("drive", 'share_window', fallback=0.2),
+    max_batch=config.getint("drive", 'share_batch', fallback=100),
+    thread_name_prefix="download"
+)
+
+def observe_drive_timing(name, seconds):
+    if name == 'wait':
+        QUEUE_WAIT_SECONDS.observe(seconds, queue='download')
+    else:
+        STAGE_SECONDS.observe(seconds, stage='drive_upload' if name == 'create' else 'drive_share')
+
+drive_uploader.timing_listeners.append(observe_drive_timing)
+drive_uploader.start()
+memo_readiness = MemoReadiness(grace=config.getfloat("queue", 'file_grace', fallback=5))
+
+registry.gauge("memobot_task_queue_depth", "Tasks waiting in the partitioned task queue", task_queue.qsize)
+registry.gauge("memobot_journal_pending", "Journaled tasks not yet acknowledged", task_journal.pending)
+
+def collect_stats():
+    """把各模組既有的統計數字轉成 metrics"""
+    mirror = sheets_mirror.snapshot()
+    drive = drive_uploader.snapshot()
+    cache = llm_cache.snapshot()
+    router = llm.router.snapshot()
+    breaker_states = {"closed": 0, "half_open": 1, "open": 2}
+    return [
+        ("memobot_mirror_batches_total", "counter", "Sheets batchUpdate calls", [({}, mirror["batches"])]),
+        ("memobot_mirror_items_total", "counter", "Memo changes mirrored to Sheets", [({}, mirror["items"])]),
+        ("memobot_mirror_failures_total", "counter", "Mirror batches that stopped on a failure", [({}, mirror["failures"])]),
+        ("memobot_mirror_dead_letters_total", "counter", "Mirror operations given up after repeated failures", [({}, mirror["dead_letters"])]),
+        ("memobot_mirror_last_flush_seconds", "gauge", "Duration of the last mirror flush", [({}, mirror["last_flush_seconds"])]),
+        ("memobot_llm_cache_requests_total", "counter", "LLM cache lookups by result",
+         [({"result": name}, cache[name]) for name in ("hits", "misses", "coalesced")]),
+        ("memobot_llm_cache_saved_seconds_total", "counter", "LLM latency saved by the cache", [({}, cache["saved_seconds"])]),
+        ("memobot_llm_cache_entries", "gauge", "Entries in the LLM response cache", [({}, cache["size"])]),
+        ("memobot_drive_uploads_total", "counter", "Files uploaded to Drive", [({}, drive["uploads"])]),
+        ("memobot_drive_source_retries_total", "counter", "Drive uploads restarted after the source stream failed",
+         [({}, drive["source_retries"])]),
+        ("memobot_drive_share_batches_total", "counter", "Drive permission batch requests", [({}, drive["batches"])]),
+        ("memobot_drive_shared_total", "counter", "Drive files shared through batches", [({}, drive["shared"])]),
+        ("memobot_drive_failures_total", "counter", "Drive uploads or shares that gave up", [({}, drive["failures"])]),
+        ("memobot_company_cache_entries", "gauge", "Cached company names", [({}, len(company_cache))]),
+        ("memobot_quota_wait_seconds_total", "counter", "Time spent waiting for Google API quota tokens",
+         [({"bucket": name}, stats["wait_seconds"]) for name, stats in quota.snapshot().items()]),
+        ("memobot_quota_acquired_total", "counter", "Google API quota tokens acquired",
+         [({"bucket": name}, stats["acquired"]) for name, stats in quota.snapshot().items()]),
+        ("memobot_llm_router_total", "counter", "LLM router requests by outcome",
+         [({"outcome": name}, value) for name, value in router["stats"].items()]),
+        ("memobot_llm_provider_errors_total", "counter", "LLM provider errors",
+         [({"provider": name}, p["errors"]) for name, p in router["providers"].items()]),
+        ("memobot_llm_provider_latency_seconds", "histogram", "LLM provider latency",
+         [({"provider": name}, p["latency"]) for name, p in router["providers"].items()]),
+        ("memobot_llm_circuit_state", "gauge", "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+         [({"provider": name}, breaker_states[p["state"]]) for name, p in router["providers"].items()]),
+    ]
+
+registry.add_collector(collect_stats)
+
+# 只取樣 Flask 的 request 執行緒與背景 worker，預設不啟動，由 /profile/<secret_key> 開啟
+profiler = SamplingProfiler(
+    log_directory,
+    thread_filter=lambda name: name.startswith(("task-worker", "download")) or "process_request_thread" in name
+)
+
+def dispatch_task(seq, kind, key, args):
+    # replay 是 at-least-once：已經 commit 但還沒 ack 就當機的任務不再執行
+    if memo_store.task_applied(seq):
+        logging.info(f"Task {seq} was already applied, acking")
+        task_journal.ack(seq)
+        return
+
+    def run(submitted, **kwargs):
+        QUEUE_WAIT_SECONDS.observe(time.time() - submitted, queue=kind)
         try:
-            task()
+            with STAGE_SECONDS.time(stage=kind):
+                TASK_HANDLERS[kind](seq=seq, **kwargs)
         finally:
-            task_queue.task_done()
+            task_journal.ack(seq)
+
+    def submit(**kwargs):
+        submitted = time.time()
+        task_queue.submit(key, lambda: run(submitted, **kwargs))
 
-# 啟動佇列處理執行緒
-threading.Thread(target=process_queue, daemon=True).start()
+    if kind != 'file':
+        submit(**args)
+        return
+
+    # 檔案先在傳輸階段串流上傳到 Drive，等同一使用者的 memo 就緒後才交給該使用者的 worker
+    def uploaded(future):
+        try:
+            link = future.result()
+        except Exception as e:
+            logging.error(f"Error uploading file: {e}")
+            task_journal.ack(seq)
+            return
+        memo_readiness.when_ready(
+            key, args['received_at'],
+            lambda: submit(link=link, file_name=args['file_name'])
+        )
+
+    # 上次已經上傳過的檔案只重新分享，不再上傳第二份
+    file_id = memo_store.task_file(seq)
+    if file_id is not None:
+        drive_uploader.share(file_id).add_done_callback(uploaded)
+    else:
+        upload_to_drive(args['message_id'], args['file_name'], seq).add_done_callback(uploaded)
+
+def enqueue_task(kind, key, **args):
+    EVENTS.inc(event=kind)
+    with STAGE_SECONDS.time(stage='enqueue'):
+        seq = task_journal.append(kind, key, args)
+        dispatch_task(seq, kind, key, args)
 
 @app.route('/')
 def home():
@@ -77,44 +224,62 @@ def callback(secret_key):
     body = request.get_data(as_text=True)
 
     try:
-        handler.handle(body, signature)
+        # 先單獨驗證簽章以便計時 (handle 內會再驗一次，HMAC 的成本可忽略)
+        with STAGE_SECONDS.time(stage='signature'):
+            if not handler.parser.signature_validator.validate(body, signature):
+                raise InvalidSignatureError("Invalid signature")
+        with STAGE_SECONDS.time(stage='handle'):
+            handler.handle(body, signature)
     except InvalidSignatureError:
         logging.error("Invalid signature error")
+        EVENTS.inc(event='invalid_signature')
         abort(400)
 
     return 'OK'
 
-@retry(tries=5, delay=2, backoff=2)
-def upload_to_drive(file_path, file_name):
-    try:
-        file_metadata = {'name': file_name}
-        media = MediaFileUpload(file_path, mimetype='application/pdf', resumable=True)
-        file = drive_service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-
-        # 取得公開連結
-        file_id = file.get('id')
-        drive_service.permissions().create(fileId=file_id, body={'type': 'anyone', 'role': 'reader'}).execute()
-        link = f"https://drive.google.com/file/d/{file_id}/view"
-        logging.info(f"File uploaded successfully: {link}")
-        return link
-    except Exception as e:
-        logging.error(f"Failed to upload to drive: {e}")
-        raise e
-
-@retry(tries=5, delay=2, backoff=2)
-def find_and_update_empty_cell(link, file_name):
-    try:
-        sheet_range = 'A:C'
-        result = sheets_service.spreadsheets().values().get(
-            spreadsheetId=spreadsheet_id,
-            range=sheet_range
-        ).execute()
-
-        values = result.get('values', [])
-        row_index = 1  # 開始於第二行
-
-        try:
-            gemi_response = gemi.Gemini_Template(f"""
+@app.route("/profile/<secret_key>", methods=['POST'])
+def profile(secret_key):
+    if secret_key != config.get("secret", "key"):
+        logging.error("Unauthorized access attempt")
+        abort(403)
+    seconds = min(request.args.get('seconds', 30, type=float), config.getfloat("profiler", 'max_seconds', fallback=120))
+    interval = max(request.args.get('interval', 0.01, type=float), 0.001)
+    path = profiler.start(seconds, interval)
+    if path is None:
+        return 'Profiler already running', 409
+    logging.info(f"Profiling for {seconds}s, output: {path}")
+    return path
+
+@app.route("/metrics/<secret_key>")
+def metrics(secret_key):
+    if secret_key != config.get("secret", "key"):
+        abort(403)
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+def upload_to_drive(message_id, file_name, seq=None):
+    """回傳 Future，分享完成後得到連結；LINE 的內容在上傳的 worker 開始時才取得
+
+    串流中斷時 drive_uploader 會再呼叫一次 media()，重新向 LINE 取得內容並建立新的上傳 session。
+    """
+    def media():
+        # LINE 的檔案內容直接串流進 Drive resumable 上傳，不寫入暫存檔
+        message_content = line_bot_api.get_message_content(message_id)
+        return StreamingMediaUpload(message_content.iter_content(chunk_size=LINE_CHUNK_SIZE), mimetype='application/pdf')
+    on_created = (lambda file_id: memo_store.set_task_file(seq, file_id)) if seq is not None else None
+    return drive_uploader.upload(file_name, media, on_created=on_created)
+
+# 公司名稱的 prompt 有修改時要更新版本號，舊的快取才不會被沿用
+COMPANY_PROMPT_VERSION = 'v1'
+GEMINI_ERROR = "GEMINI解析錯誤"
+
+# 同一個檔名重送或 @retry 重跑時不再呼叫 LLM，失敗結果只短暫快取
+company_cache = DiskCache(config.get("cache", 'path', fallback='data/cache.db'), 'company_names',
+                          max_entries=config.getint("cache", 'company_max_entries', fallback=10000))
+company_failure_cache = DiskCache(config.get("cache", 'path', fallback='data/cache.db'), 'company_name_failures',
+                                  ttl=config.getint("cache", 'company_failure_ttl', fallback=300))
+
+def company_prompt(file_name):
+    return f"""
             【PDF檔案名稱】：{file_name}
             
             需求：請幫我從【PDF檔案名稱】提取出你認為這個檔案在講述的"一家"公司名稱
@@ -133,94 +298,74 @@ def find_and_update_empty_cell(link, file_name):
             舉例: 富邦銀行對摩根大通2020年的財務分析報告.pdf
             就提取出"摩根"
             因為在這個舉例中，富邦銀行只是做出這份分析報告的公司，但這份分析報告描述的是"摩根大通"，而非"富邦銀行"
-            """)
-        except:
-            gemi_response = "GEMINI解析錯誤"
+            """
+
+def company_cache_key(file_name):
+    normalized = " ".join(unicodedata.normalize('NFKC', file_name).lower().split())
+    return f"{COMPANY_PROMPT_VERSION}:{normalized}"
+
+def extract_company_name(file_name):
+    key = company_cache_key(file_name)
+    cached = company_cache.get(key)
+    if cached is not None:
+        logging.info(f"Company name cache hit: {file_name}")
+        return cached
+    if company_failure_cache.get(key) is not None:
+        return GEMINI_ERROR
+
+    try:
+        with STAGE_SECONDS.time(stage='company_name'):
+            gemi_response = llm.ask(company_prompt(file_name), output_way="text")
+    except Exception as e:
+        logging.error(f"Failed to extract company name: {e}")
+        company_failure_cache.set(key, GEMINI_ERROR)
+        return GEMINI_ERROR
+
+    company_cache.set(key, gemi_response)
+    return gemi_response
+
+@retry(tries=5, delay=2, backoff=2)
+def find_and_update_empty_cell(link, file_name, seq=None):
+    try:
+        gemi_response = extract_company_name(file_name)
 
         logging.info(f"Gemini response 公司名稱: {gemi_response}")
 
-        while row_index < len(values):
-            row = values[row_index]
-            while len(row) < 3:
-                row.append('')
-            try:
-                if row[2] == '':
-                    if row[200] != '':
-                        pa = "pass"
-            except:
-                try:
-                    memo_text = row[1]
-                except:
-                    memo_text = ""
-
-                logging.info(f"Processing memo text: {memo_text}")
-                if gemi_response in memo_text:
-                    sheets_service.spreadsheets().values().update(
-                        spreadsheetId=spreadsheet_id,
-                        range=f'C{row_index + 1}',
-                        valueInputOption='RAW',
-                        body={'values': [[link]]}
-                    ).execute()
-                    logging.info(f"Updated cell C{row_index + 1} with link {link}")
-                    return True
-            row_index += 1
-
-        # 如果找不到空的 C 欄位，則新增一筆資料在第二行
-        timestamp = datetime.datetime.now(pytz.timezone('Asia/Taipei')).strftime("%Y/%m/%d %H:%M:%S")
-        append_to_sheet(date=timestamp, text=f"NOT_FOUND:{gemi_response}", pdf_link=link)
-        return False
+        with memo_store.transaction():
+            if not memo_store.claim_task(seq):
+                logging.info(f"Task {seq} was already applied, skipping")
+                return True
+            memo_id = memo_store.find_unlinked(gemi_response)
+            if memo_id is not None:
+                memo_store.set_link(memo_id, link)
+                logging.info(f"Updated memo {memo_id} with link {link}")
+                return True
+
+            # 如果找不到空的 C 欄位，則新增一筆資料在第二行
+            timestamp = datetime.datetime.now(pytz.timezone('Asia/Taipei')).strftime("%Y/%m/%d %H:%M:%S")
+            append_to_sheet(date=timestamp, text=f"NOT_FOUND:{gemi_response}", pdf_link=link)
+            return False
     except Exception as e:
         logging.error(f"Failed to find and update empty cell: {e}")
         raise e
 
-def append_to_sheet(date, text=None, pdf_link=None):
+def append_to_sheet(date, text=None, pdf_link=None, seq=None):
     try:
-        sheet_range = 'A:C'
-
-        # 先取得目前的值
-        result = sheets_service.spreadsheets().values().get(
-            spreadsheetId=spreadsheet_id,
-            range=sheet_range
-        ).execute()
-        values = result.get('values', [])
-        
-        # 確保每行都有足夠的列數
-        for row in values:
-            while len(row) < 3:
-                row.append('')
-
-        # 檢查是否有 NOT_FOUND 的項目
-        for i, row in enumerate(values):
-            if len(row) > 1 and row[1].startswith('NOT_FOUND:'):
-                gemi_response = row[1].split(':')[1]
-                if gemi_response in text:
-                    values[i][1] = text
-                    values[i][2] = row[2]
-                    logging.info(f"Updated row {i + 1} with new memo {text} and link {row[2]}")
-                    value_range_body = {
-                        "values": values
-                    }
-                    response = sheets_service.spreadsheets().values().update(
-                        spreadsheetId=spreadsheet_id,
-                        range=sheet_range,
-                        valueInputOption="RAW",
-                        body=value_range_body
-                    ).execute()
-                    logging.info(f"Update response: {response}")
-                    return
-
-        # 如果找不到 NOT_FOUND 的項目，則新增一筆資料在第二行
-        values.insert(1, [date, text, pdf_link])
-        value_range_body = {
-            "values": values
-        }
-        response = sheets_service.spreadsheets().values().update(
-            spreadsheetId=spreadsheet_id,
-            range=sheet_range,
-            valueInputOption="RAW",
-            body=value_range_body
-        ).execute()
-        logging.info(f"Append response: {response}")
+        with memo_store.transaction():
+            # seq 與 memo 在同一個 transaction 內寫入，replay 時不會重複新增
+            if not memo_store.claim_task(seq):
+                logging.info(f"Task {seq} was already applied, skipping")
+                return
+            # 檢查是否有 NOT_FOUND 的項目
+            memo_id = memo_store.find_not_found(text)
+            if memo_id is not None:
+                memo_store.update_memo(memo_id, text)
+                logging.info(f"Updated memo {memo_id} with new memo {text}")
+                return
+
+            # 如果找不到 NOT_FOUND 的項目，則新增一筆資料在第二行
+            memo_id = memo_store.insert(date, text, pdf_link)
+            logging.info(f"Appended memo {memo_id}")
     except Exception as e:
         logging.error(f"Failed to append to sheet: {e}")
         raise e
@@ -237,48 +382,41 @@ def handle_text_message(event):
 
     logging.info(f"Text message received: {text}")
     # 將任務加入佇列，確保 memo 上傳完成後再處理
-    task_queue.put(lambda: append_to_sheet_and_wait(date=timestamp, text=text, pdf_link=pdf_link))
+    enqueue_task('memo', user_id, date=timestamp, text=text, pdf_link=pdf_link)
+    memo_readiness.memo_received(user_id)
 
 @handler.add(MessageEvent, message=FileMessage)
 def handle_file_message(event):
-    time.sleep(5)
-    message_id = event.message.id
-    message_content = line_bot_api.get_message_content(message_id)
-    ext = event.message.file_name.split('.')[-1]
-    file_path = f"tmp/{message_id}.{ext}"
-
-    def save_file():
-        try:
-            with open(file_path, 'wb') as fd:
-                for chunk in message_content.iter_content():
-                    fd.write(chunk)
-            logging.info(f"File saved: {file_path}")
-
-            task_queue.put(lambda: process_file(file_path, event.message.file_name))
-        except Exception as e:
-            logging.error(f"Error saving file: {e}")
-
-    save_file()
+    # 只記錄任務就回應 LINE，下載與上傳都在背景進行
+    logging.info(f"File message received: {event.message.file_name}")
+    enqueue_task('file', event.source.user_id, message_id=event.message.id,
+                 file_name=event.message.file_name, received_at=time.time())
 
 @retry(tries=5, delay=2, backoff=2)
-def append_to_sheet_and_wait(date, text=None, pdf_link=None):
-    append_to_sheet(date, text, pdf_link)
-    time.sleep(2)
+def append_to_sheet_and_wait(date, text=None, pdf_link=None, seq=None):
+    append_to_sheet(date, text, pdf_link, seq)
 
 @retry(tries=5, delay=2, backoff=2)
-def process_file(file_path, file_name):
+def process_file(link, file_name, seq=None):
     try:
-        link = upload_to_drive(file_path, file_name)
-        if link:
-            find_and_update_empty_cell(link, file_name)
+        find_and_update_empty_cell(link, file_name, seq)
     except Exception as e:
         logging.error(f"Error processing file: {e}")
-    finally:
-        try:
-            os.remove(file_path)
-            logging.info(f"File removed: {file_path}")
-        except Exception as e:
-            logging.error(f"Failed to remove file: {e}")
+
+TASK_HANDLERS = {
+    'memo': append_to_sheet_and_wait,
+    'file': process_file,
+}
+
+# 重新執行上次未完成的任務，再啟動佇列處理執行緒；已 ack 的任務不會再 replay，不必保留套用記錄
+pending_records = task_journal.replay()
+memo_store.forget_tasks(record['seq'] for record in pending_records)
+for record in pending_records:
+    dispatch_task(record['seq'], record['kind'], record['key'], record['args'])
+logging.info(f"Replayed {task_journal.pending()} pending tasks from journal")
+# 在接收請求前先載入 embedding 模型與 client，第一個查詢不必負擔初始化成本
+logging.info(f"Warmed up embedding model: {weaviate_op.warm_up()}")
+task_queue.start()
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", threaded=True)
@@ -7,8 +7,7 @@ import pandas as pd
 from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
 from datetime import datetime
 import io
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import utils.google_clients as google_clients
 from googleapiclient.http import MediaIoBaseUpload
 
 chrome_options = Options()
@@ -96,13 +95,7 @@ def get_consecutive_change(stock_ratios):
     return -count if sign == 1 else count
 
 def upload_to_drive(file_content):
-    SCOPES = ['https://www.googleapis.com/auth/drive.file']
-    SERVICE_ACCOUNT_FILE = 'cred.json'
-
-    credentials = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-
-    drive_service = build('drive', 'v3', credentials=credentials)
+    drive_service = google_clients.drive()
 
     file_metadata = {
         'name': 'stock_report.xlsx',
@@ -121,13 +114,7 @@ def upload_to_drive(file_content):
     return f"https://drive.google.com/file/d/{file_id}/view?usp=sharing"
 
 def update_google_sheet(date, link):
-    SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-    SERVICE_ACCOUNT_FILE = 'cred.json'
-
-    credentials = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-
-    sheets_service = build('sheets', 'v4', credentials=credentials)
+    sheets_service = google_clients.sheets()
     spreadsheet_id = '1XgZF7I9HyjRveGid483HFLvmrup8CgUdJhNWbiZDFrs'
     range_name = 'A:B'
     
@@ -0,0 +1,95 @@
+# DriveUploader：來源串流 (LINE 的內容) 讀到一半失敗時，要重新呼叫 media() 建立新的上傳，而不是直接放棄
+# 用法：python test/drive_upload_retry_test.py (或 pytest test/drive_upload_retry_test.py)
+import sys, os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.drive_stream import StreamingMediaUpload
+from utils.drive_uploader import DriveUploader
+
+CHUNK = 256 * 1024
+
+class FakeRequest:
+    """逐 chunk 讀取 media，與 googleapiclient 的 resumable 上傳一樣先問大小再取資料"""
+
+    def __init__(self, service, media):
+        self.service = service
+        self.resumable = media
+        self.offset = 0
+
+    def next_chunk(self, num_retries=0):
+        size = self.resumable.size()
+        data = self.resumable.getbytes(self.offset, self.resumable.chunksize())
+        self.offset += len(data)
+        if size is not None and self.offset >= size:
+            self.service.uploaded.append(self.offset)
+            return None, {"id": f"F{len(self.service.uploaded)}"}
+        return None, None
+
+class FakeBatch:
+    def __init__(self, callback):
+        self.callback = callback
+        self.ids = []
+
+    def add(self, request, request_id):
+        self.ids.append(request_id)
+
+    def execute(self):
+        for request_id in self.ids:
+            self.callback(request_id, {}, None)
+
+class FakeDrive:
+    def __init__(self):
+        self.uploaded = []
+
+    def files(self):
+        return self
+
+    def permissions(self):
+        return self
+
+    def create(self, media_body=None, **kwargs):
+        return FakeRequest(self, media_body)
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(callback)
+
+def flaky_media(failures):
+    """前 failures 次建立的串流在第一個 chunk 之後中斷"""
+    calls = []
+    def media():
+        calls.append(1)
+        broken = len(calls) <= failures
+        def chunks():
+            yield b'x' * CHUNK
+            if broken:
+                raise ConnectionError("LINE content stream reset")
+            yield b'y' * CHUNK
+        return StreamingMediaUpload(chunks(), 'application/pdf', chunksize=CHUNK)
+    return media, calls
+
+def test_stream_failure_is_retried_with_fresh_media():
+    drive = FakeDrive()
+    uploader = DriveUploader(drive, window=0.01)
+    uploader.start()
+    media, calls = flaky_media(1)
+    created = []
+    link = uploader.upload('a.pdf', media, on_created=created.append).result(timeout=10)
+    assert link == "https://drive.google.com/file/d/F1/view"
+    assert len(calls) == 2
+    assert drive.uploaded == [2 * CHUNK]
+    assert created == ['F1']
+    assert uploader.snapshot()["source_retries"] == 1
+
+def test_gives_up_after_tries():
+    uploader = DriveUploader(FakeDrive(), window=0.01, tries=2)
+    uploader.start()
+    media, calls = flaky_media(5)
+    future = uploader.upload('b.pdf', media)
+    assert isinstance(future.exception(timeout=10), ConnectionError)
+    assert len(calls) == 2
+    assert uploader.snapshot()["failures"] == 1
+
+if __name__ == "__main__":
+    test_stream_failure_is_retried_with_fresh_media()
+    test_gives_up_after_tries()
+    print("ok")
@@ -0,0 +1,50 @@
+# hybrid 查詢的序列化 micro-benchmark：舊的 GraphQL f-string vs. query builder + compact_vector
+# 只組 request 內容，不需要 Weaviate 伺服器；用法：python test/hybrid_query_bench.py [次數]
+import sys, os, timeit
+import numpy as np
+from weaviate.gql.get import GetBuilder
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# weaviate_query 沒有 import 時的副作用 (不讀 config.ini、不建立 logs/)，乾淨的 checkout 也能直接執行
+from utils.weaviate_query import compact_vector, hybrid_query
+
+CLASS_NM = "Memo"
+QUERY_TEXT = '老師 蔡炎龍 學生 "AI" 專題'
+ALPHA = 0.5
+NUM = 3
+
+def fstring_query(query_text, query_vector):
+    vector_str = ",".join(map(str, query_vector))
+    return f"""
+        {{
+            Get {{
+                {CLASS_NM}(hybrid: {{query: "{query_text}", vector: [{vector_str}], alpha: {ALPHA} }}, limit: {NUM}) {{
+                    content
+                    _additional {{
+                        distance
+                        score
+                    }}
+                }}
+            }}
+        }}
+        """
+
+def builder_query(query_text, query_vector):
+    return hybrid_query(GetBuilder(CLASS_NM, ["content"], None), query_text, query_vector, ALPHA, NUM).build()
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    vector = np.random.default_rng(0).standard_normal(384).astype(np.float32)
+    vector /= np.linalg.norm(vector)
+
+    for name, build in (("f-string", fstring_query), ("builder", builder_query)):
+        query = build(QUERY_TEXT, vector)
+        seconds = timeit.timeit(lambda: build(QUERY_TEXT, vector), number=runs)
+        print(f"{name:10s} {len(query.encode('utf-8')):7d} bytes  {seconds / runs * 1e6:8.1f} us/query")
+
+    restored = np.asarray(compact_vector(vector), dtype=np.float32)
+    print(f"compact_vector max error {np.abs(restored - vector).max():.2e}, "
+          f"cosine error {abs(1 - float(restored @ vector) / float(np.linalg.norm(restored))):.2e}")
+    # 查詢文字含引號時舊寫法產生的 GraphQL 不合法
+    print("f-string escapes quotes:", '\\"AI\\"' in fstring_query(QUERY_TEXT, vector))
+    print("builder escapes quotes: ", '\\"AI\\"' in builder_query(QUERY_TEXT, vector))
@@ -0,0 +1,54 @@
+# 本地 hybrid search：純關鍵字 (alpha=0) 查詢不能回傳沒有命中任何關鍵字的 memo
+# 用法：python test/local_search_test.py (或 pytest test/local_search_test.py)，需要 config.ini
+import sys, os, tempfile
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import numpy as np
+
+import utils.local_search as local_search
+from utils.memo_store import MemoStore
+
+class CharEmbedder:
+    """以字元雜湊組成的小向量代替 SentenceTransformer，測試不必載入模型"""
+
+    def get_sentence_embedding_dimension(self):
+        return 16
+
+    def encode(self, texts, normalize_embeddings=False, **kwargs):
+        single = isinstance(texts, str)
+        vectors = np.zeros((1 if single else len(texts), 16), dtype=np.float32)
+        for row, text in enumerate([texts] if single else texts):
+            for char in text:
+                vectors[row, hash(char) % 16] += 1
+        if normalize_embeddings:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors[0] if single else vectors
+
+def make_search(directory):
+    local_search.get_embedder = CharEmbedder
+    local_search.config.set('Weaviate', 'vector_path', directory)
+    store = MemoStore(os.path.join(directory, 'memo.db'))
+    store.insert('d', '台積電 法說會 重點', '')
+    store.insert('d', '摩根大通 年報', '')
+    store.insert('d', '午餐 菜單', '')
+    return local_search.LocalSemanticSearch('Memo', store)
+
+def test_pure_keyword_skips_non_matching():
+    search = make_search(tempfile.mkdtemp())
+    results = search.hybrid_search('台積電', 3, 0.0)
+    assert [result['content'] for result in results] == ['台積電 法說會 重點']
+
+def test_pure_keyword_without_match_is_empty():
+    search = make_search(tempfile.mkdtemp())
+    assert search.hybrid_search('不存在', 3, 0.0) == []
+
+def test_hybrid_still_uses_vector_candidates():
+    search = make_search(tempfile.mkdtemp())
+    results = search.hybrid_search('台積電', 3, 0.5)
+    assert results[0]['content'] == '台積電 法說會 重點'
+    assert len(results) == 3
+
+if __name__ == "__main__":
+    test_pure_keyword_skips_non_matching()
+    test_pure_keyword_without_match_is_empty()
+    test_hybrid_still_uses_vector_candidates()
+    print("ok")
@@ -0,0 +1,74 @@
+# 任務 replay 的冪等性：memo 已經 commit、還沒 ack 就當機，重新啟動後不能再新增一次
+# 用法：python test/task_replay_test.py (或 pytest test/task_replay_test.py)
+import sys, os, tempfile, time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.memo_store import MemoStore
+from utils.task_journal import TaskJournal
+
+def apply_memo(store, seq, date, text):
+    """與 main_p2.append_to_sheet 相同：claim 與 insert 在同一個 transaction"""
+    with store.transaction():
+        if not store.claim_task(seq):
+            return False
+        store.insert(date, text, '')
+        return True
+
+def count_memos(store):
+    return store.conn.execute("SELECT COUNT(*) FROM memos").fetchone()[0]
+
+def test_crash_between_commit_and_ack():
+    directory = tempfile.mkdtemp()
+    db_path = os.path.join(directory, 'memo.db')
+    journal_path = os.path.join(directory, 'tasks.journal')
+
+    journal = TaskJournal(journal_path)
+    store = MemoStore(db_path)
+    seq = journal.append('memo', 'user', {"date": "d", "text": "會議紀錄", "pdf_link": ""})
+    assert apply_memo(store, seq, "d", "會議紀錄")
+    # 當機：沒有 ack，直接換一組新的 instance 讀同樣的檔案
+
+    journal = TaskJournal(journal_path)
+    store = MemoStore(db_path)
+    records = journal.replay()
+    assert [record['seq'] for record in records] == [seq]
+    assert store.task_applied(seq)
+    assert not apply_memo(store, seq, "d", "會議紀錄")
+    assert count_memos(store) == 1
+
+def test_seq_survives_empty_journal():
+    """全部 ack 之後日誌被清空，重新啟動的 seq 仍然不能與已套用的任務重複"""
+    directory = tempfile.mkdtemp()
+    journal_path = os.path.join(directory, 'tasks.journal')
+    store = MemoStore(os.path.join(directory, 'memo.db'))
+
+    journal = TaskJournal(journal_path, max_bytes=1)
+    seq = journal.append('memo', 'user', {})
+    assert apply_memo(store, seq, "d", "第一筆")
+    journal.ack(seq)
+    # 等背景執行緒寫入 ack、清空日誌並寫回 next_seq
+    for _ in range(100):
+        with open(journal_path, 'rb') as f:
+            if f.read().startswith(b'{"next_seq"'):
+                break
+        time.sleep(0.01)
+
+    journal = TaskJournal(journal_path)
+    new_seq = journal.append('memo', 'user', {})
+    assert new_seq > seq
+    assert apply_memo(store, new_seq, "d", "第二筆")
+    assert count_memos(store) == 2
+
+def test_uploaded_file_is_recorded():
+    store = MemoStore(os.path.join(tempfile.mkdtemp(), 'memo.db'))
+    store.set_task_file(7, 'FILE_ID')
+    assert store.task_file(7) == 'FILE_ID'
+    assert not store.task_applied(7)
+    store.forget_tasks([])
+    assert store.task_file(7) is None
+
+if __name__ == "__main__":
+    test_crash_between_commit_and_ack()
+    test_seq_survives_empty_journal()
+    test_uploaded_file_is_recorded()
+    print("ok")
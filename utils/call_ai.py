@@ -1,19 +1,37 @@
 import json
+import numpy as np
 
 import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from utils.gpt_tem import GPT_Template
-from utils.gemini_tem import Gemini_Template
+from utils.llm_router import ask
+from utils.weaviate_op import config, logger, get_embedder, query_cache
+from utils.embedding_cache import EmbeddingCache
 
-def call_aied(wait, quest):
+# local: 先用 MiniLM 向量排序，第一名與第二名差距小於 margin 才交給 LLM；llm: 一律交給 LLM
+RERANK_MODE = config.get("rerank", 'mode', fallback='local')
+RERANK_MARGIN = config.getfloat("rerank", 'margin', fallback=0.05)
+# 同一批候選常被重複 rerank，候選的向量也快取起來
+candidate_cache = EmbeddingCache(max_entries=config.getint("rerank", 'cache_size', fallback=4096))
+
+def rerank(wait, quest):
+    """回傳依 cosine 相似度由高到低的候選 index 與各候選的分數"""
+    model = get_embedder()
+    query = query_cache.get_or_encode(quest, model.encode)
+    vectors = np.stack([candidate_cache.get_or_encode(candidate, model.encode) for candidate in wait])
+    scores = vectors @ query / np.maximum(np.linalg.norm(vectors, axis=1) * np.linalg.norm(query), 1e-12)
+    return np.argsort(-scores), scores
+
+def parse_output(response):
+    return json.loads(response)["輸出"]
+
+def call_llm(wait, quest):
+    options = "\n".join(f'"選項{i}": {candidate}' for i, candidate in enumerate(wait, 1))
     prompt = f"""
-請從下列三個選項中選擇出最適合回答 "我的問題" 的答案
+請從下列 {len(wait)} 個選項中選擇出最適合回答 "我的問題" 的答案
 
 "我的問題": {quest}
 
-"選項一": {wait[0]}
-"選項二": {wait[1]}
-"選項三": {wait[2]}
+{options}
 
 輸出: 請將選中的那個選項內的 *所有資訊* 都輸出出來
 
@@ -23,13 +41,26 @@ json 格式:
 }}
 """
     try:
-        res = Gemini_Template(prompt)
-        res = json.loads(res)["輸出"]
+        # 解析不了的回應不寫入 LLM 快取，下次同樣的問題會重新詢問
+        res = parse_output(ask(prompt, validate=parse_output))
     except:
         res = "GEMINI解析錯誤"
 
     return res
 
+def call_aied(wait, quest):
+    if RERANK_MODE == 'local' and wait:
+        try:
+            order, scores = rerank(wait, quest)
+            margin = scores[order[0]] - scores[order[1]] if len(wait) > 1 else float('inf')
+            if margin >= RERANK_MARGIN:
+                return wait[order[0]]
+            logger.info(f"Rerank margin {margin:.3f} below {RERANK_MARGIN}, falling back to LLM")
+        except Exception as e:
+            logger.error(f"Local rerank failed: {e}")
+
+    return call_llm(wait, quest)
+
 if __name__ == "__main__":
     quest = "你喜歡吃什麼?"
     wait = ["我喜歡吃蛋餅", "我喜歡打藍球", "我是個人類"]
@@ -0,0 +1,58 @@
+from googleapiclient.http import MediaUpload
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+class StreamingMediaUpload(MediaUpload):
+    """以 generator (例如 LINE 的 iter_content) 為來源的 resumable 上傳，不落地成暫存檔
+
+    MediaIoBaseUpload 需要可 seek 的檔案才能算出大小，這裡改為直接實作 MediaUpload：
+    記憶體裡只保留 Drive 尚未確認的資料與預讀的部分 (最多約兩個 chunk)，
+    chunk 上傳失敗時 googleapiclient 會從上次確認的位置重新呼叫 getbytes 續傳。
+    """
+
+    def __init__(self, chunks, mimetype, chunksize=UPLOAD_CHUNK_SIZE):
+        super().__init__()
+        if chunksize % (256 * 1024) != 0:
+            raise ValueError("chunksize must be a multiple of 256 KiB")
+        self._chunks = iter(chunks)
+        self._mimetype = mimetype
+        self._chunksize = chunksize
+        self._buffer = bytearray()
+        self._offset = 0
+        self._eof = False
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        # googleapiclient 每送一個 chunk 前都會先問大小，先預讀才能在最後一個 chunk 帶上總大小
+        # 讀到結尾之前大小未知，googleapiclient 會以 "*" 表示
+        self._fill(2 * self._chunksize)
+        return self._offset + len(self._buffer) if self._eof else None
+
+    def resumable(self):
+        return True
+
+    def has_stream(self):
+        return False
+
+    def getbytes(self, begin, length):
+        if begin < self._offset:
+            raise ValueError(f"Cannot rewind stream to {begin}, already released up to {self._offset}")
+
+        # 丟掉 Drive 已經確認收到的部分
+        del self._buffer[:begin - self._offset]
+        self._offset = begin
+
+        self._fill(length)
+        return bytes(self._buffer[:length])
+
+    def _fill(self, length):
+        while len(self._buffer) <= length and not self._eof:
+            try:
+                self._buffer.extend(next(self._chunks))
+            except StopIteration:
+                self._eof = True
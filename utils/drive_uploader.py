@@ -0,0 +1,193 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from googleapiclient.errors import HttpError
+
+DRIVE_BATCH_LIMIT = 100
+ANYONE_READER = {'type': 'anyone', 'role': 'reader'}
+
+class DriveUploader(threading.Thread):
+    """上傳檔案到 Drive 並開放連結分享，以 Future 回傳公開連結
+
+    媒體仍以 resumable 方式逐檔上傳 (Drive 的 batch 端點不接受媒體內容，metadata 隨上傳的第一個請求送出)，
+    上傳完成的檔案先放進待分享佇列，一小段時間窗內的 permissions().create 合併成一次
+    new_batch_http_request 送出。一次轉寄多個檔案時，分享只需要一次往返。
+    Drive 回應的錯誤只靠 googleapiclient 的 num_retries 在同一個 resumable session 內重試；建立 media 或讀取來源
+    失敗時 (media 為函式才能重建) 以相同的退避重新建立 media 與 session。分享失敗的檔案
+    記下最早的重試時間，之後併入其他批次，不會卡住同時等待分享的檔案。
+    """
+
+    def __init__(self, drive_service, quota=None, workers=2, window=0.2, max_batch=DRIVE_BATCH_LIMIT, tries=5,
+                 link_format="https://drive.google.com/file/d/{id}/view", thread_name_prefix="drive-upload"):
+        super().__init__(daemon=True, name=f"{thread_name_prefix}-share")
+        self.drive_service = drive_service
+        self.quota = quota
+        self.window = window
+        self.max_batch = min(max_batch, DRIVE_BATCH_LIMIT)
+        self.tries = tries
+        self.link_format = link_format
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=thread_name_prefix)
+        # 待分享的 (file id, future, 第幾次嘗試, 最早可送出的時間)
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        # 以 (階段名稱, 秒數) 通知：wait (排隊)、create (上傳)、share (一次 batch)
+        self.timing_listeners = []
+        self.stats = {"uploads": 0, "source_retries": 0, "batches": 0, "shared": 0, "failures": 0, "last_batch_size": 0}
+
+    def upload(self, name, media, on_created=None, **metadata):
+        """排入上傳，回傳的 Future 在檔案分享完成後得到連結
+
+        media 可以是 MediaUpload 或回傳 MediaUpload 的函式 (在 worker thread 中才建立，例如串流的來源要上傳時才打開)。
+        on_created(file id) 在上傳完成、開始分享之前呼叫，呼叫端可以先記下檔案避免重送時重複上傳。
+        """
+        future = Future()
+        queued = time.time()
+        self.executor.submit(self._create, future, queued, dict(metadata, name=name), media, on_created)
+        return future
+
+    def share(self, file_id):
+        """只分享已經上傳過的檔案 (重複建立同樣的 anyone 權限不會有副作用)"""
+        future = Future()
+        self._enqueue_share(file_id, future)
+        return future
+
+    def _enqueue_share(self, file_id, future):
+        with self.lock:
+            self.pending.append((file_id, future, 1, 0.0))
+        self.wakeup.set()
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def _timing(self, name, seconds):
+        for listener in self.timing_listeners:
+            listener(name, seconds)
+
+    def _create(self, future, queued, metadata, media, on_created=None, attempt=1):
+        self._timing('wait', time.time() - queued)
+        start = time.time()
+        try:
+            try:
+                file_id = self._create_file(metadata, media)
+            except HttpError:
+                # Drive 的錯誤已經由 num_retries 重試過
+                raise
+            except Exception as e:
+                # 建立 media 或讀取來源時失敗 (例如 LINE 的內容串流中斷)：num_retries 只會重讀同一個已經壞掉的串流，
+                # 這裡重新呼叫 media() 並建立新的 resumable session，到時間才重新排入，不佔用 worker
+                if not callable(media) or attempt >= self.tries:
+                    raise
+                delay = min(2 ** (attempt - 1), 30)
+                logging.warning(f"Failed to read {metadata['name']} for upload (attempt {attempt}): {e}, retrying in {delay}s")
+                self._count("source_retries")
+                retry = threading.Timer(delay, self.executor.submit, (
+                    self._create, future, time.time() + delay, metadata, media, on_created, attempt + 1
+                ))
+                retry.daemon = True
+                retry.start()
+                return
+            if on_created is not None:
+                on_created(file_id)
+        except Exception as e:
+            logging.error(f"Failed to upload {metadata['name']} to drive: {e}")
+            self._count("failures")
+            future.set_exception(e)
+            return
+        finally:
+            self._timing('create', time.time() - start)
+
+        self._count("uploads")
+        self._enqueue_share(file_id, future)
+
+    def _create_file(self, metadata, media):
+        media_body = media() if callable(media) else media
+        request = self.drive_service.files().create(body=metadata, media_body=media_body, fields='id')
+        # 只有這一層重試：num_retries 在同一個 resumable session 內續傳，不會重新建立 session 或重讀來源
+        if request.resumable is None:
+            self._charge()
+            return request.execute(num_retries=self.tries - 1)['id']
+        # resumable 上傳的每個 chunk 都是一次寫入請求，自己逐 chunk 送出，每個 chunk 各取一個 drive_write token
+        response = None
+        while response is None:
+            self._charge()
+            _, response = request.next_chunk(num_retries=self.tries - 1)
+        return response['id']
+
+    def _charge(self, tokens=1):
+        if self.quota is not None:
+            self.quota.acquire('drive_write', tokens)
+
+    def _next_due(self):
+        """距離最早一筆延後重試的分享還有幾秒，沒有待分享的檔案時回傳 None (等到有新檔案)"""
+        with self.lock:
+            if not self.pending:
+                return None
+            return max(min(item[3] for item in self.pending) - time.time(), 0.0)
+
+    def run(self):
+        while True:
+            self.wakeup.wait(timeout=self._next_due())
+            # 等待一個短暫的時間窗，讓同一波上傳完成的檔案合併成一批
+            time.sleep(self.window)
+            self.wakeup.clear()
+            while self._share_batch():
+                pass
+
+    def _share_batch(self):
+        now = time.time()
+        with self.lock:
+            items, waiting = [], []
+            for item in self.pending:
+                (items if item[3] <= now and len(items) < self.max_batch else waiting).append(item)
+            self.pending = waiting
+        if not items:
+            return False
+
+        errors = {}
+        def callback(request_id, response, exception):
+            if exception is not None:
+                errors[request_id] = exception
+
+        start = time.time()
+        batch = self.drive_service.new_batch_http_request(callback=callback)
+        for index, (file_id, _, _, _) in enumerate(items):
+            batch.add(self.drive_service.permissions().create(fileId=file_id, body=ANYONE_READER), request_id=str(index))
+        try:
+            self._charge(len(items))
+            batch.execute()
+        except Exception as e:
+            errors = {str(index): e for index in range(len(items))}
+        elapsed = time.time() - start
+        self._timing('share', elapsed)
+
+        with self.lock:
+            self.stats["batches"] += 1
+            self.stats["last_batch_size"] = len(items)
+        retry_items = []
+        for index, (file_id, future, attempt, _) in enumerate(items):
+            error = errors.get(str(index))
+            if error is None:
+                self._count("shared")
+                link = self.link_format.format(id=file_id)
+                logging.info(f"File uploaded successfully: {link}")
+                future.set_result(link)
+            elif attempt < self.tries:
+                # 指數退避，到時間後併入之後的批次
+                retry_items.append((file_id, future, attempt + 1, time.time() + min(2 ** (attempt - 1), 30)))
+            else:
+                logging.error(f"Failed to share drive file {file_id}: {error}")
+                self._count("failures")
+                future.set_exception(error)
+        logging.info(f"Shared {len(items) - len(errors)} of {len(items)} drive files in one batch ({elapsed:.3f}s)")
+
+        if retry_items:
+            with self.lock:
+                self.pending.extend(retry_items)
+        return True
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
@@ -0,0 +1,93 @@
+import atexit
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+def normalize_query(text):
+    return " ".join(unicodedata.normalize('NFKC', text).lower().split())
+
+class EmbeddingCache:
+    """查詢文字 -> float32 向量的 LRU 快取，支援 TTL、命中統計與選擇性的磁碟保存"""
+
+    def __init__(self, max_entries=1024, ttl=None, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path:
+            self.load()
+            atexit.register(self.save)
+
+    def get_or_encode(self, text, encode):
+        key = normalize_query(text)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        vector = np.asarray(encode(text), dtype=np.float32)
+        vector.setflags(write=False)
+        with self.lock:
+            self.entries[key] = (vector, now + self.ttl if self.ttl else None)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return vector
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            items = list(self.entries.items())
+        if not items:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp.npz'
+        np.savez(
+            tmp_path,
+            keys=np.array([key for key, _ in items]),
+            vectors=np.stack([vector for _, (vector, _) in items]),
+            expires=np.array([np.nan if expires is None else expires for _, (_, expires) in items], dtype=np.float64)
+        )
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path) as data:
+                now = time.time()
+                for key, vector, expires in zip(data["keys"], data["vectors"], data["expires"]):
+                    expires = None if np.isnan(expires) else float(expires)
+                    if expires is not None and expires <= now:
+                        continue
+                    vector = vector.astype(np.float32)
+                    vector.setflags(write=False)
+                    self.entries[str(key)] = (vector, expires)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        except Exception as e:
+            logging.error(f"Failed to load embedding cache: {e}")
@@ -1,14 +1,38 @@
 import requests, json
+import asyncio
 import sys, os
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import utils.config_log as config_log
+from utils.llm_cache import get_llm_cache
 config, logger, CONFIG_PATH = config_log.setup_config_and_logging()
 config.read(CONFIG_PATH)
 
-def Gemini_Template(prompt):
-    api_key = config.get("Gemini", 'api_key')
-    url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-pro:generateContent?key={api_key}'
+# 設定只在載入時讀一次
+API_KEY = config.get("Gemini", 'api_key')
+BASE_URL = config.get("Gemini", 'base_url', fallback='https://generativelanguage.googleapis.com/v1beta')
+MODEL = config.get("Gemini", 'model', fallback='gemini-pro')
+TIMEOUT = (config.getfloat("Gemini", 'connect_timeout', fallback=5), config.getfloat("Gemini", 'read_timeout', fallback=60))
+CONCURRENCY = config.getint("Gemini", 'concurrency', fallback=8)
+
+# 共用的 session：連線池 + keep-alive，連續呼叫不必每次重新 TLS handshake
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(CONCURRENCY, 10))
+session.mount('https://', adapter)
+session.mount('http://', adapter)
+session.headers.update({'Content-Type': 'application/json'})
+# async 版本使用的 thread pool，大小與 concurrency 相同 (預設 executor 在小機器上只有幾個 thread)
+_executor = ThreadPoolExecutor(max_workers=CONCURRENCY, thread_name_prefix="gemini")
+llm_cache = get_llm_cache(config)
+
+def Gemini_Template(prompt, validate=None):
+    """validate(回應) 不成立時不寫入快取"""
+    return llm_cache.get_or_call("gemini", MODEL, "", prompt, lambda: _generate(prompt), validate)
+
+def _generate(prompt):
+    url = f'{BASE_URL}/models/{MODEL}:generateContent?key={API_KEY}'
     payload = {
         "contents": [
             {
@@ -20,12 +44,27 @@ def Gemini_Template(prompt):
             }
         ]
     }
-    headers = {
-        'Content-Type': 'application/json'
-    }
-    response = (requests.post(url, headers=headers, data=json.dumps(payload))).json()
+    response = session.post(url, data=json.dumps(payload), timeout=TIMEOUT)
+    response.raise_for_status()
+    response = response.json()
     return response["candidates"][0]["content"]["parts"][0]["text"]
 
+async def Gemini_Template_async(prompt, semaphore=None):
+    """在背景 thread 執行 Gemini_Template，可用 semaphore 限制同時送出的數量"""
+    loop = asyncio.get_running_loop()
+    if semaphore is None:
+        return await loop.run_in_executor(_executor, Gemini_Template, prompt)
+    async with semaphore:
+        return await loop.run_in_executor(_executor, Gemini_Template, prompt)
+
+async def Gemini_batch(prompts, concurrency=CONCURRENCY):
+    """同時送出多個 prompt，最多 concurrency 個並行；回傳順序與 prompts 相同，失敗的位置是 exception"""
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(
+        *(Gemini_Template_async(prompt, semaphore) for prompt in prompts),
+        return_exceptions=True
+    )
+
 if __name__ == "__main__":
     prompt = f"""告訴我 CTF 逆向分析的 3 個訣竅，用 json 格式輸出: {{"訣竅1": ,"訣竅2": ,"訣竅3": }}"""
     response = Gemini_Template(prompt)
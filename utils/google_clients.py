@@ -0,0 +1,90 @@
+import configparser
+import json
+import os
+import threading
+
+import google.auth
+import google_auth_httplib2
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import HttpRequest, build_http
+
+from utils.config_log import CONFIG_PATH
+
+# 只讀 [google] 設定，不經過 config_log 的 logging 設定 (GitHub Actions 上沒有 config.ini 與 logs/)
+config = configparser.ConfigParser()
+config.read(CONFIG_PATH)
+
+CREDENTIALS_FILE = config.get("google", 'credentials', fallback='cred.json')
+
+_lock = threading.Lock()
+_credentials = {}
+_services = {}
+_local = threading.local()
+
+def _endpoint(name):
+    """測試時可把 API 指向本地的假伺服器：環境變數 GOOGLE_<NAME>_ENDPOINT 或 [google] <name>_endpoint"""
+    return os.environ.get(f"GOOGLE_{name.upper()}_ENDPOINT") or config.get("google", f"{name}_endpoint", fallback='') or None
+
+def get_credentials(scopes, path=None):
+    """同一組 scopes 的憑證只讀一次，token 由 google-auth 自動更新"""
+    path = path or CREDENTIALS_FILE
+    key = (path, tuple(sorted(scopes)))
+    with _lock:
+        if key not in _credentials:
+            _credentials[key], _ = google.auth.load_credentials_from_file(path, scopes=list(scopes))
+        return _credentials[key]
+
+def _thread_http(credentials):
+    """httplib2.Http 不是 thread-safe，每個執行緒各自保留一個 (連線在同一執行緒內重複使用)
+
+    以 build_http 建立 (timeout 60 秒)：它會把 308 排除在 redirect 之外，resumable 上傳的中間 chunk 回應 308，
+    直接用 httplib2.Http() 會被當成缺少 Location 的 redirect 而失敗。
+    """
+    cache = getattr(_local, 'http', None)
+    if cache is None:
+        cache = _local.http = {}
+    http = cache.get(id(credentials))
+    if http is None:
+        http = cache[id(credentials)] = google_auth_httplib2.AuthorizedHttp(credentials, http=build_http())
+    return http
+
+def get_service(name, version, scopes, path=None):
+    """回傳共用的 API client：使用套件內建的 discovery 文件，不必每次下載或重新解析"""
+    key = (name, version, tuple(sorted(scopes)), path)
+    with _lock:
+        service = _services.get(key)
+    if service is not None:
+        return service
+
+    endpoint = _endpoint(name)
+    if endpoint and not os.path.exists(path or CREDENTIALS_FILE):
+        credentials = AnonymousCredentials()
+    else:
+        credentials = get_credentials(scopes, path)
+
+    def request_builder(http, *args, **kwargs):
+        return HttpRequest(_thread_http(credentials), *args, **kwargs)
+
+    if endpoint:
+        # 只改 api_endpoint 時媒體上傳仍會走 rootUrl (googleapis.com/upload/...)，所以直接替換文件中的 rootUrl
+        document = json.loads(get_static_doc(name, version))
+        document["rootUrl"] = document["mtlsRootUrl"] = endpoint if endpoint.endswith('/') else endpoint + '/'
+        service = build_from_document(document, http=_thread_http(credentials), requestBuilder=request_builder)
+    else:
+        service = build(
+            name, version,
+            http=_thread_http(credentials),
+            requestBuilder=request_builder,
+            static_discovery=True,
+            cache_discovery=False
+        )
+    with _lock:
+        return _services.setdefault(key, service)
+
+def drive(scopes=('https://www.googleapis.com/auth/drive.file',), path=None):
+    return get_service('drive', 'v3', scopes, path)
+
+def sheets(scopes=('https://www.googleapis.com/auth/spreadsheets',), path=None):
+    return get_service('sheets', 'v4', scopes, path)
@@ -1,41 +1,92 @@
 import textwrap
+import threading, time
+from collections import deque
 from openai import AzureOpenAI
 
 import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import utils.config_log as config_log
+from utils.llm_cache import get_llm_cache
 config, logger, CONFIG_PATH = config_log.setup_config_and_logging()
 config.read(CONFIG_PATH)
 
-def GPT_Template(prompt, output_way="json"):
-    """GPT-35 使用模板"""
-    Azure_Open_AI_VERSION = 'Open_AI'
-    client = AzureOpenAI(
-        azure_endpoint = config.get(Azure_Open_AI_VERSION, 'azure_endpoint'),
-        api_key = config.get(Azure_Open_AI_VERSION, 'api_key'),
-        api_version = config.get(Azure_Open_AI_VERSION, 'api_version'),
-        azure_deployment = config.get(Azure_Open_AI_VERSION, 'azure_deployment')
-    )
+Azure_Open_AI_VERSION = 'Open_AI'
 
+# 整個 process 共用一個 client (與其 HTTP 連線池)，第一次呼叫時才建立
+_client = None
+_client_lock = threading.Lock()
+# 最近幾次呼叫的延遲 (秒)：ttft 為收到第一個 token 的時間，只有 streaming 呼叫會記錄
+latency_log = deque(maxlen=1000)
+llm_cache = get_llm_cache(config)
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = AzureOpenAI(
+                    azure_endpoint = config.get(Azure_Open_AI_VERSION, 'azure_endpoint'),
+                    api_key = config.get(Azure_Open_AI_VERSION, 'api_key'),
+                    api_version = config.get(Azure_Open_AI_VERSION, 'api_version'),
+                    azure_deployment = config.get(Azure_Open_AI_VERSION, 'azure_deployment')
+                )
+    return _client
+
+def _messages(prompt, output_way):
     userPrompt = textwrap.dedent(f"""
         {prompt}
     """)
+    return [
+        {"role": "system", "content": f"使用繁體中文回答, 並使用 {output_way} 格式回傳"},
+        {"role": "user", "content": userPrompt},
+    ]
+
+def GPT_Template(prompt, output_way="json", validate=None):
+    """GPT-35 使用模板，validate(回應) 不成立時不寫入快取"""
+    model = config.get(Azure_Open_AI_VERSION, 'azure_deployment')
+    messages = _messages(prompt, output_way)
+
+    def call():
+        start = time.time()
+        response = get_client().chat.completions.create(model=model, messages=messages)
+        latency_log.append({"stream": False, "ttft": None, "total": time.time() - start})
+        return response.choices[0].message.content
+
+    return llm_cache.get_or_call("gpt", model, messages[0]["content"], messages[1]["content"], call, validate)
 
-    response = client.chat.completions.create(
-        model=config.get(Azure_Open_AI_VERSION, 'azure_deployment'),
-        messages=[
-            {"role": "system", "content": f"使用繁體中文回答, 並使用 {output_way} 格式回傳"},
-            {"role": "user", "content": userPrompt},
-        ]
-    )
-    return(response.choices[0].message.content)
+def GPT_Template_stream(prompt, output_way="text"):
+    """GPT_Template 的 streaming 版本，token 一到就 yield，呼叫端可以邊收邊轉送"""
+    start = time.time()
+    ttft = None
+    try:
+        stream = get_client().chat.completions.create(
+            model=config.get(Azure_Open_AI_VERSION, 'azure_deployment'),
+            messages=_messages(prompt, output_way),
+            stream=True
+        )
+        for chunk in stream:
+            # Azure 的第一個 chunk 只有 content filter 結果，沒有 choices
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if ttft is None:
+                    ttft = time.time() - start
+                yield delta
+    finally:
+        total = time.time() - start
+        latency_log.append({"stream": True, "ttft": ttft, "total": total})
+        logger.info(f"GPT stream ttft: {ttft}, total: {total:.2f}s")
 
 def main():
     """ 範例: GPT 模板使用 """
     # import utils.gpt_integration as gpt_call
     # gpt_call.GPT_Template()
     print(GPT_Template('問題: 太陽系有哪些行星？請用 json 格式回傳，{"回傳內容": "_回答_"}'))
+    for token in GPT_Template_stream('問題: 太陽系有哪些行星？'):
+        print(token, end='', flush=True)
+    print("\n", latency_log[-1])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
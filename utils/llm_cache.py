@@ -0,0 +1,99 @@
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import Future
+
+from utils.disk_cache import DiskCache
+
+class LLMResponseCache:
+    """以 (provider, model, system prompt, prompt) 的 hash 為 key 的 LLM 回應快取
+
+    同一個 prompt 同時有多個請求時只有第一個真的送出，其他等它的結果 (single-flight)。
+    stats 記錄命中率與省下的 LLM 延遲 (以寫入時量到的延遲估算)。
+    傳入 validate 時，沒通過檢查的回應 (例如解析不了的 JSON) 照樣回傳但不寫入快取，下次會重新詢問。
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "saved_seconds": 0.0}
+
+    @staticmethod
+    def make_key(provider, model, system, prompt):
+        payload = json.dumps([provider, model, system, prompt], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _record(self, name, saved=0.0):
+        with self.lock:
+            self.stats[name] += 1
+            self.stats["saved_seconds"] += saved
+
+    @staticmethod
+    def _valid(validate, response):
+        try:
+            return validate is None or validate(response) is not False
+        except Exception:
+            return False
+
+    def get_or_call(self, provider, model, system, prompt, call, validate=None):
+        key = self.make_key(provider, model, system, prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            cached = json.loads(cached)
+            if self._valid(validate, cached["response"]):
+                self._record("hits", cached["latency"])
+                return cached["response"]
+            # 加上檢查之前寫入的錯誤回應
+            self.cache.delete(key)
+
+        with self.lock:
+            future = self.inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self.inflight[key] = Future()
+        if not leader:
+            start = time.time()
+            result = future.result()
+            self._record("coalesced", max(future.latency - (time.time() - start), 0.0))
+            return result
+
+        self._record("misses")
+        start = time.time()
+        try:
+            result = call()
+            future.latency = time.time() - start
+            if self._valid(validate, result):
+                self.cache.set(key, json.dumps({"response": result, "latency": future.latency}, ensure_ascii=False))
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_rate"] = (stats["hits"] + stats["coalesced"]) / lookups if lookups else 0.0
+        stats["size"] = len(self.cache)
+        return stats
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+def get_llm_cache(config):
+    """所有 prompt 模板共用同一個快取"""
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMResponseCache(DiskCache(
+                config.get("cache", 'path', fallback='data/cache.db'), 'llm_responses',
+                max_entries=config.getint("cache", 'llm_max_entries', fallback=5000),
+                ttl=config.getint("cache", 'llm_ttl', fallback=86400)
+            ))
+        return _llm_cache
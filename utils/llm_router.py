@@ -0,0 +1,218 @@
+import bisect
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import sys, os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.gemini_tem import config, logger, Gemini_Template
+from utils.gpt_tem import GPT_Template
+
+# 延遲直方圖的 bucket 上限 (秒)
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60, float('inf'))
+
+class LatencyHistogram:
+    """固定 bucket 的延遲直方圖，percentile 回傳該 bucket 的上限"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def percentile(self, p):
+        with self.lock:
+            if self.count == 0:
+                return None
+            target = p * self.count
+            seen = 0
+            for bound, count in zip(self.buckets, self.counts):
+                seen += count
+                if seen >= target:
+                    return bound
+            return self.buckets[-1]
+
+    def snapshot(self):
+        with self.lock:
+            return {"buckets": list(zip(self.buckets, self.counts)), "count": self.count, "sum": self.sum}
+
+class CircuitBreaker:
+    """連續失敗 failures 次就斷路 cooldown 秒，之後放行一次試探請求 (half-open)"""
+
+    def __init__(self, failures=5, cooldown=30):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.time() - self.opened_at >= self.cooldown:
+                return "half_open"
+            return "open"
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at >= self.cooldown and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def record(self, ok):
+        with self.lock:
+            self.trial = False
+            if ok:
+                self.consecutive = 0
+                self.opened_at = None
+                return
+            self.consecutive += 1
+            if self.consecutive >= self.failures or self.opened_at is not None:
+                self.opened_at = time.time()
+
+class Provider:
+    def __init__(self, name, call, breaker):
+        self.name = name
+        self.call = call
+        self.breaker = breaker
+        self.latency = LatencyHistogram()
+        self.errors = 0
+
+class LLMRouter:
+    """先送主要的 provider，超過延遲預算 (主要 provider 的 hedge_percentile 延遲) 還沒回來，
+    就對次要 provider 送出 hedged request，取先成功的結果；斷路中的 provider 直接跳過。
+    """
+
+    def __init__(self, providers, hedge_percentile=0.9, initial_budget=3.0, min_samples=20, workers=8):
+        self.providers = providers
+        self.hedge_percentile = hedge_percentile
+        self.initial_budget = initial_budget
+        self.min_samples = min_samples
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm")
+        self.stats = {"requests": 0, "hedged": 0, "hedge_wins": 0, "failures": 0}
+        self.lock = threading.Lock()
+
+    def budget(self, provider):
+        if provider.latency.count < self.min_samples:
+            return self.initial_budget
+        return min(provider.latency.percentile(self.hedge_percentile), self.initial_budget * 10)
+
+    def _submit(self, provider, prompt, output_way, validate):
+        start = time.time()
+
+        def run():
+            try:
+                result = provider.call(prompt, output_way, validate)
+            except Exception:
+                provider.errors += 1
+                provider.breaker.record(False)
+                raise
+            finally:
+                # 落後的請求完成時也記錄，直方圖才不會只看到比較快的那一半
+                provider.latency.observe(time.time() - start)
+            provider.breaker.record(True)
+            return result
+
+        future = self.executor.submit(run)
+        future.provider = provider
+        return future
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def ask(self, prompt, output_way="json", validate=None):
+        """validate 交給各 provider 的快取，沒通過檢查的回應不會被快取"""
+        self._count("requests")
+        candidates = list(self.providers)
+
+        def next_provider():
+            # 輪到的時候才詢問斷路器，half-open 的試探機會不會被沒用到的 provider 佔走
+            while candidates:
+                provider = candidates.pop(0)
+                if provider.breaker.allow():
+                    return provider
+            return None
+
+        primary = next_provider()
+        if primary is None:
+            self._count("failures")
+            raise Exception("All LLM providers are unavailable (circuit open)")
+
+        pending = {self._submit(primary, prompt, output_way, validate)}
+        done, _ = wait(pending, timeout=self.budget(primary))
+        errors = []
+
+        while True:
+            for future in done:
+                pending.discard(future)
+                if future.exception() is None:
+                    if future.provider is not primary:
+                        self._count("hedge_wins")
+                    return future.result()
+                errors.append(f"{future.provider.name}: {future.exception()}")
+                logger.info(f"LLM provider {future.provider.name} failed: {future.exception()}")
+
+            # 逾時或失敗都改送下一個 provider，已送出的請求繼續等
+            backup = next_provider()
+            if backup is not None:
+                self._count("hedged")
+                pending.add(self._submit(backup, prompt, output_way, validate))
+            if not pending:
+                self._count("failures")
+                raise Exception(f"All LLM providers failed: {'; '.join(errors)}")
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+    def snapshot(self):
+        return {
+            "stats": dict(self.stats),
+            "providers": {
+                p.name: {"state": p.breaker.state, "errors": p.errors, "latency": p.latency.snapshot()}
+                for p in self.providers
+            },
+        }
+
+def build_router(primary=None, secondary=None):
+    """預設 Gemini 為主、GPT 為次；backend 的網址由 [Gemini] base_url / [Open_AI] azure_endpoint 設定，
+    測試時可以指向本地的 stub server，或直接傳入其他 callable(prompt, output_way, validate)"""
+    breaker = lambda: CircuitBreaker(
+        config.getint("router", 'breaker_failures', fallback=5),
+        config.getfloat("router", 'breaker_cooldown', fallback=30)
+    )
+    providers = [
+        # Gemini 的輸出格式寫在 prompt 裡，GPT 另外由 system prompt 指定
+        Provider("gemini", primary or (lambda prompt, output_way, validate: Gemini_Template(prompt, validate)), breaker()),
+        Provider("gpt", secondary or GPT_Template, breaker()),
+    ]
+    order = [name.strip() for name in config.get("router", 'order', fallback='gemini,gpt').split(',') if name.strip()]
+    providers = [p for name in order for p in providers if p.name == name]
+    return LLMRouter(
+        providers,
+        hedge_percentile=config.getfloat("router", 'hedge_percentile', fallback=0.9),
+        initial_budget=config.getfloat("router", 'initial_budget', fallback=3.0),
+        min_samples=config.getint("router", 'min_samples', fallback=20),
+        workers=config.getint("router", 'workers', fallback=8),
+    )
+
+router = build_router()
+
+def ask(prompt, output_way="json", validate=None):
+    return router.ask(prompt, output_way, validate)
+
+if __name__ == "__main__":
+    print(ask('告訴我 CTF 逆向分析的 3 個訣竅，用 json 格式輸出: {"訣竅1": ,"訣竅2": ,"訣竅3": }'))
+    print(router.snapshot())
@@ -0,0 +1,228 @@
+import math
+import os
+import threading
+import unicodedata
+from collections import defaultdict
+import numpy as np
+
+from utils.memo_store import MemoStore, NOT_FOUND_PREFIX
+from utils.vector_store import VectorStore
+from utils.weaviate_op import config, get_embedder, query_cache
+
+def tokenize(text):
+    """關鍵字比對用的 token：整個詞加上詞內的字元 bigram (中文沒有空白斷詞)"""
+    tokens = []
+    for word in unicodedata.normalize('NFKC', text).lower().split():
+        tokens.append(word)
+        if len(word) > 2:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+class KeywordScorer:
+    """本地的 BM25 關鍵字評分，對應 Weaviate hybrid search 的 keyword 部分"""
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.lengths = []
+        # 每篇文件的 token，移除文件時用來找出要清掉的 postings
+        self.terms = []
+        self.live = 0
+
+    def add(self, text):
+        """加入一篇文件，回傳它的 doc index"""
+        doc_index = len(self.lengths)
+        counts = defaultdict(int)
+        tokens = tokenize(text)
+        for token in tokens:
+            counts[token] += 1
+        for token, tf in counts.items():
+            self.postings[token].append((doc_index, tf))
+        self.lengths.append(len(tokens))
+        self.terms.append(tuple(counts))
+        self.live += 1
+        return doc_index
+
+    def remove(self, doc_index):
+        """移除文件 (memo 內容被修改時)，doc index 保留但不再有分數，也不計入 BM25 的統計"""
+        for token in self.terms[doc_index]:
+            posting = [entry for entry in self.postings[token] if entry[0] != doc_index]
+            if posting:
+                self.postings[token] = posting
+            else:
+                del self.postings[token]
+        self.terms[doc_index] = ()
+        self.lengths[doc_index] = 0
+        self.live -= 1
+
+    def scores(self, query_text):
+        scores = np.zeros(len(self.lengths), dtype=np.float32)
+        n = self.live
+        if n == 0:
+            return scores
+        lengths = np.asarray(self.lengths, dtype=np.float32)
+        avg_length = max(lengths.sum() / n, 1.0)
+        for token in set(tokenize(query_text)):
+            posting = self.postings.get(token)
+            if not posting:
+                continue
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            docs = np.fromiter((d for d, _ in posting), dtype=np.int64, count=len(posting))
+            tf = np.fromiter((t for _, t in posting), dtype=np.float32, count=len(posting))
+            norm = self.k1 * (1 - self.b + self.b * lengths[docs] / avg_length)
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+def _normalize(scores):
+    """relative score fusion：把分數線性縮放到 0~1"""
+    if scores.size == 0:
+        return scores
+    low, high = scores.min(), scores.max()
+    if high - low < 1e-12:
+        return np.full_like(scores, 1.0 if high > 0 else 0.0)
+    return (scores - low) / (high - low)
+
+class LocalSemanticSearch:
+    """不需要 Weaviate 伺服器的 in-process 向量搜尋，介面與 WeaviateSemanticSearch 相同
+
+    memo 向量 (已正規化) 存在磁碟上的 VectorStore，以 memmap 讀取，重新啟動不必重新編碼；
+    cosine top-k 以 argpartition 向量化計算。keyword 部分用本地 BM25 (第一次用到時才建立)，
+    兩者以 alpha 加權 (alpha=1 為純向量，alpha=0 為純關鍵字)。
+    兩種索引都依 MemoStore 的 version 追上變更，NOT_FOUND 佔位資料補上內容後也會被編碼。
+    """
+
+    VERSION_KEY = 'memo_version'
+
+    def __init__(self, classNm, store=None):
+        self.classNm = classNm
+        self.embeddings = get_embedder()
+        self.store = store or MemoStore(config.get("store", 'path'))
+        self.lock = threading.Lock()
+        self.vectors = VectorStore(
+            os.path.join(config.get('Weaviate', 'vector_path', fallback='data/vectors'), classNm),
+            self.embeddings.get_sentence_embedding_dimension(),
+            seal_rows=config.getint('Weaviate', 'vector_seal_rows', fallback=50000)
+        )
+        self.vectors.start_compaction(config.getint('Weaviate', 'vector_compact_interval', fallback=600))
+        self.keywords = KeywordScorer()
+        # keyword_ids[doc index] 為 memo id，已移除的文件為 -1
+        self.keyword_ids = []
+        self.keyword_docs = {}
+        self.keyword_version = 0
+        self.refresh()
+
+    @staticmethod
+    def _indexable(memo):
+        return bool(memo.strip()) and not memo.startswith(NOT_FOUND_PREFIX)
+
+    def _indexed_version(self):
+        # 舊的向量庫沒有記錄 version：當時依 id 遞增編碼，而舊資料的初始 version 就是 id
+        return self.vectors.meta(self.VERSION_KEY, self.vectors.max_id())
+
+    def refresh(self):
+        """把新增或內容有修改的 memo 編碼並寫入，修改過的 memo 先刪除舊向量"""
+        # 沒有變更時不必取得寫入鎖 (compaction 進行中也不會卡住查詢)
+        if self.store.latest_version() <= self._indexed_version():
+            return
+        with self.vectors.writer():
+            changes = list(self.store.iter_changes(self._indexed_version()))
+            if not changes:
+                return
+            changed_ids = np.array([memo_id for _, memo_id, _, _ in changes], dtype=np.int64)
+            stale = changed_ids[np.isin(changed_ids, self.vectors.live_ids())]
+            if stale.size:
+                self.vectors.delete(stale.tolist())
+            docs = [(memo_id, memo) for _, memo_id, _, memo in changes if self._indexable(memo)]
+            if docs:
+                vectors = self.embeddings.encode(
+                    [memo for _, memo in docs], batch_size=64,
+                    show_progress_bar=False, normalize_embeddings=True
+                ).astype(np.float32)
+                self.vectors.append([memo_id for memo_id, _ in docs], vectors)
+            # 寫入後才記錄 version；中途中斷時重跑只會再刪除並重新寫入同一批
+            self.vectors.set_meta(self.VERSION_KEY, changes[-1][0])
+
+    def _keyword_scores(self, query_text):
+        with self.lock:
+            for version, memo_id, _, memo in self.store.iter_changes(self.keyword_version):
+                doc_index = self.keyword_docs.pop(memo_id, None)
+                if doc_index is not None:
+                    self.keywords.remove(doc_index)
+                    self.keyword_ids[doc_index] = -1
+                if self._indexable(memo):
+                    self.keyword_docs[memo_id] = self.keywords.add(memo)
+                    self.keyword_ids.append(memo_id)
+                self.keyword_version = version
+            return np.asarray(self.keyword_ids, dtype=np.int64), self.keywords.scores(query_text)
+
+    def aggregate_count(self):
+        return {"data": {"Aggregate": {self.classNm: [{"meta": {"count": len(self.vectors.live_ids())}}]}}}
+
+    def get_all_data(self, limit=3):
+        memo_ids = self.vectors.live_ids()[:limit].tolist()
+        memos = self.store.get_memos(memo_ids)
+        return {"data": {"Get": {self.classNm: [
+            {"uuid": str(memo_id), "title": memos[memo_id][0], "content": memos[memo_id][1]}
+            for memo_id in memo_ids if memo_id in memos
+        ]}}}
+
+    def delete_class(self):
+        self.vectors.delete(self.vectors.live_ids().tolist())
+
+    @staticmethod
+    def _top_k(scores, k):
+        if k >= scores.size:
+            return np.argsort(-scores)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+
+    @staticmethod
+    def _lookup(ids, scores, wanted, missing=None):
+        """取出 wanted (已排序) 中每個 memo id 的分數，沒有分數的給 missing (預設為最低分)"""
+        if missing is None:
+            missing = scores.min() if scores.size else 0.0
+        result = np.full(wanted.size, missing, dtype=np.float32)
+        positions = np.nonzero(np.isin(ids, wanted))[0]
+        result[np.searchsorted(wanted, ids[positions])] = scores[positions]
+        return result
+
+    def hybrid_search(self, query_text, num, alpha, query_vector=None):
+        self.refresh()
+        if query_vector is None:
+            query_vector = query_cache.get_or_encode(query_text, self.embeddings.encode)
+        query_vector = query_vector / max(np.linalg.norm(query_vector), 1e-12)
+
+        ids, similarity = self.vectors.scores(query_vector)
+        if ids.size == 0:
+            return []
+        empty = np.array([], dtype=np.int64)
+        if alpha < 1:
+            keyword_ids, keyword = self._keyword_scores(query_text)
+            # 沒有命中任何關鍵字 (BM25 為 0) 或已從向量庫刪除的 memo 不列入關鍵字候選
+            live = (keyword > 0) & np.isin(keyword_ids, ids)
+            keyword_ids, keyword = keyword_ids[live], keyword[live]
+        else:
+            keyword_ids, keyword = empty, np.array([], dtype=np.float32)
+
+        # 只在兩種檢索各自的候選集合上做分數融合
+        candidates = np.union1d(
+            ids[self._top_k(similarity, num)] if alpha > 0 else empty,
+            keyword_ids[self._top_k(keyword, num)] if alpha < 1 else empty
+        ).astype(np.int64)
+        candidate_similarity = self._lookup(ids, similarity, candidates)
+        candidate_keyword = self._lookup(keyword_ids, keyword, candidates, missing=0.0)
+        fused = alpha * _normalize(candidate_similarity) + (1 - alpha) * _normalize(candidate_keyword)
+        order = np.argsort(-fused)[:num].tolist()
+        memos = self.store.get_memos(candidates[order].tolist())
+
+        return [
+            {
+                "content": memos[int(candidates[i])][1],
+                "_additional": {
+                    "distance": float(1 - candidate_similarity[i]),
+                    "score": str(float(fused[i])),
+                }
+            }
+            for i in order
+        ]
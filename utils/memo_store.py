@@ -0,0 +1,298 @@
+import sqlite3
+import threading
+import os
+from contextlib import contextmanager
+from utils.ngram_index import NgramIndex, KeywordIndex
+
+NOT_FOUND_PREFIX = 'NOT_FOUND:'
+# 在寫入 transaction 內取得下一個 version，寫入端彼此互斥所以不會重複
+NEXT_VERSION = "(SELECT COALESCE(MAX(version), 0) + 1 FROM memos)"
+
+class MemoStore:
+    """本地 memo 主儲存 (SQLite WAL)，Google Sheets 只是非同步鏡像
+
+    每一次資料變動都會在同一個 transaction 內寫入 outbox，
+    由 SheetsMirror 依序把 row-level 的差異同步到 Sheets；一直失敗的操作移到 dead letter (failed = 1)，
+    不會擋住之後的操作。
+    尚未有連結的 memo 與 NOT_FOUND 佔位資料另外維護在記憶體索引中，查詢不必掃描全部資料。
+    memo 內容每次新增或修改都會取得遞增的 version，向量與關鍵字索引依 version 追上變更 (見 iter_changes)。
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.lock = threading.RLock()
+        self.listeners = []
+        self._depth = 0
+        self._dirty = False
+
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS memos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT NOT NULL DEFAULT '',
+                memo TEXT NOT NULL DEFAULT '',
+                link TEXT NOT NULL DEFAULT '',
+                mirrored INTEGER NOT NULL DEFAULT 0,
+                version INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS outbox (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                op TEXT NOT NULL,
+                memo_id INTEGER NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS task_state (
+                seq INTEGER PRIMARY KEY,
+                drive_file_id TEXT,
+                applied INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        self._migrate()
+        self._rebuild_index()
+
+    def _migrate(self):
+        """舊的資料庫沒有 version 欄位：以 id 作為初始 version (與原本依 id 遞增建立索引的順序相同)"""
+        with self.transaction():
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(memos)")]
+            if 'version' not in columns:
+                self.conn.execute("ALTER TABLE memos ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+                self.conn.execute("UPDATE memos SET version = id")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS memos_version ON memos (version)")
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(outbox)")]
+            if 'failed' not in columns:
+                self.conn.execute("ALTER TABLE outbox ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+                self.conn.execute("ALTER TABLE outbox ADD COLUMN failed INTEGER NOT NULL DEFAULT 0")
+
+    def _rebuild_index(self):
+        self.unlinked = NgramIndex()
+        self.placeholders = KeywordIndex()
+        for memo_id, memo, link in self.conn.execute("SELECT id, memo, link FROM memos"):
+            self._index(memo_id, memo, link)
+
+    def _index(self, memo_id, memo, link):
+        if link == '':
+            self.unlinked.add(memo_id, memo)
+        else:
+            self.unlinked.remove(memo_id)
+        if memo.startswith(NOT_FOUND_PREFIX):
+            self.placeholders.add(memo_id, memo.split(':')[1])
+        else:
+            self.placeholders.remove(memo_id)
+
+    def _reindex(self, memo_id):
+        row = self.conn.execute("SELECT memo, link FROM memos WHERE id = ?", (memo_id,)).fetchone()
+        self._index(memo_id, *row)
+
+    @contextmanager
+    def transaction(self):
+        """可巢狀的寫入 transaction，最外層 commit 後才通知 listeners"""
+        with self.lock:
+            if self._depth == 0:
+                self.conn.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield self.conn
+            except Exception:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.conn.execute("ROLLBACK")
+                    self._dirty = False
+                    self._rebuild_index()
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self.conn.execute("COMMIT")
+                dirty, self._dirty = self._dirty, False
+                if dirty:
+                    for listener in self.listeners:
+                        listener()
+
+    def _enqueue(self, op, memo_id):
+        # 插入列已經放棄的 memo (mirrored = -1) 在 Sheets 沒有對應的列，之後的操作直接進 dead letter
+        self.conn.execute(
+            "INSERT INTO outbox (op, memo_id, failed) VALUES (?, ?, (SELECT mirrored < 0 FROM memos WHERE id = ?))",
+            (op, memo_id, memo_id)
+        )
+        self._dirty = True
+
+    def is_empty(self):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM memos LIMIT 1").fetchone() is None
+
+    def bootstrap(self, values):
+        """用 Sheets 現有資料 (不含標題列) 初始化本地儲存，這些資料視為已同步"""
+        with self.transaction():
+            for row in reversed(values):
+                row = list(row) + [''] * (3 - len(row))
+                cursor = self.conn.execute(
+                    f"INSERT INTO memos (date, memo, link, mirrored, version) VALUES (?, ?, ?, 1, {NEXT_VERSION})",
+                    (row[0], row[1], row[2])
+                )
+                self._index(cursor.lastrowid, row[1], row[2])
+
+    def insert(self, date, memo, link):
+        with self.transaction():
+            cursor = self.conn.execute(
+                f"INSERT INTO memos (date, memo, link, version) VALUES (?, ?, ?, {NEXT_VERSION})",
+                (date or '', memo or '', link or '')
+            )
+            self._enqueue('insert', cursor.lastrowid)
+            self._reindex(cursor.lastrowid)
+            return cursor.lastrowid
+
+    def update_memo(self, memo_id, memo):
+        with self.transaction():
+            self.conn.execute(f"UPDATE memos SET memo = ?, version = {NEXT_VERSION} WHERE id = ?", (memo, memo_id))
+            self._enqueue('update', memo_id)
+            self._reindex(memo_id)
+
+    def set_link(self, memo_id, link):
+        with self.transaction():
+            self.conn.execute("UPDATE memos SET link = ? WHERE id = ?", (link, memo_id))
+            self._enqueue('update', memo_id)
+            self._reindex(memo_id)
+
+    def find_not_found(self, text):
+        """找出關鍵字出現在 text 中、最新的 NOT_FOUND 佔位資料"""
+        with self.lock:
+            return max(self.placeholders.search(text), default=None)
+
+    def find_unlinked(self, keyword):
+        """找出尚未有連結、且 memo 內含 keyword 的最新資料"""
+        with self.lock:
+            return max(self.unlinked.search(keyword), default=None)
+
+    def iter_memos(self, after_id=0, page_size=1000):
+        """依 id 順序分頁讀出所有 memo，不會一次把整個資料表載入記憶體"""
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT id, date, memo, link FROM memos WHERE id > ? ORDER BY id LIMIT ?",
+                    (after_id, page_size)
+                ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            after_id = rows[-1][0]
+
+    def iter_changes(self, after_version=0, page_size=1000):
+        """依 version 順序讀出 after_version 之後新增或修改過內容的 memo：(version, id, date, memo)"""
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT version, id, date, memo FROM memos WHERE version > ? ORDER BY version LIMIT ?",
+                    (after_version, page_size)
+                ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            after_version = rows[-1][0]
+
+    def latest_version(self):
+        with self.lock:
+            (version,) = self.conn.execute("SELECT COALESCE(MAX(version), 0) FROM memos").fetchone()
+        return version
+
+    def get_memos(self, memo_ids):
+        """回傳 {memo id: (date, memo)}"""
+        if not memo_ids:
+            return {}
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT id, date, memo FROM memos WHERE id IN ({','.join('?' * len(memo_ids))})",
+                list(memo_ids)
+            ).fetchall()
+        return {memo_id: (date, memo) for memo_id, date, memo in rows}
+
+    def pending_ops(self, limit):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT o.seq, o.op, m.id, m.date, m.memo, m.link FROM outbox o "
+                "JOIN memos m ON m.id = o.memo_id WHERE o.failed = 0 ORDER BY o.seq LIMIT ?",
+                (limit,)
+            ).fetchall()
+
+    def sheet_row_index(self, memo_id):
+        """memo 在 Sheets 中的 0-based row index (第 0 列為標題，最新資料在第 1 列)"""
+        with self.lock:
+            (newer,) = self.conn.execute(
+                "SELECT COUNT(*) FROM memos WHERE mirrored = 1 AND id > ?", (memo_id,)
+            ).fetchone()
+        return newer + 1
+
+    def record_failure(self, seq, max_attempts):
+        """記錄 outbox 操作失敗一次，達到 max_attempts 次就移到 dead letter；回傳是否已放棄
+
+        放棄的是 insert 時，這筆 memo 在 Sheets 沒有列，同一筆 memo 其餘與之後的操作也一起放棄。
+        """
+        with self.transaction():
+            self.conn.execute("UPDATE outbox SET attempts = attempts + 1 WHERE seq = ?", (seq,))
+            op, memo_id, attempts = self.conn.execute(
+                "SELECT op, memo_id, attempts FROM outbox WHERE seq = ?", (seq,)
+            ).fetchone()
+            if attempts < max_attempts:
+                return False
+            if op == 'insert':
+                self.conn.execute("UPDATE memos SET mirrored = -1 WHERE id = ?", (memo_id,))
+                self.conn.execute("UPDATE outbox SET failed = 1 WHERE memo_id = ?", (memo_id,))
+            else:
+                self.conn.execute("UPDATE outbox SET failed = 1 WHERE seq = ?", (seq,))
+            return True
+
+    def claim_task(self, seq):
+        """在套用任務的同一個 transaction 內呼叫：任務 (journal seq) 已經套用過回傳 False，否則記下並回傳 True
+
+        任務的資料寫入與這筆記錄一起 commit，replay 時就不會重複新增 memo。
+        """
+        if seq is None:
+            return True
+        with self.transaction():
+            self.conn.execute("INSERT OR IGNORE INTO task_state (seq) VALUES (?)", (seq,))
+            cursor = self.conn.execute("UPDATE task_state SET applied = 1 WHERE seq = ? AND applied = 0", (seq,))
+            return cursor.rowcount == 1
+
+    def task_applied(self, seq):
+        with self.lock:
+            row = self.conn.execute("SELECT applied FROM task_state WHERE seq = ?", (seq,)).fetchone()
+        return bool(row and row[0])
+
+    def set_task_file(self, seq, file_id):
+        """記錄任務已經上傳的 Drive 檔案，replay 時只需要重新分享而不必再上傳一次"""
+        with self.transaction():
+            self.conn.execute(
+                "INSERT INTO task_state (seq, drive_file_id) VALUES (?, ?) "
+                "ON CONFLICT(seq) DO UPDATE SET drive_file_id = excluded.drive_file_id",
+                (seq, file_id)
+            )
+
+    def task_file(self, seq):
+        with self.lock:
+            row = self.conn.execute("SELECT drive_file_id FROM task_state WHERE seq = ?", (seq,)).fetchone()
+        return row[0] if row else None
+
+    def forget_tasks(self, keep):
+        """已 ack 的任務不會再 replay，只保留 keep (journal 中尚未完成的 seq) 的記錄"""
+        with self.transaction():
+            keep = list(keep)
+            self.conn.execute(
+                f"DELETE FROM task_state WHERE seq NOT IN ({','.join('?' * len(keep))})", keep
+            )
+
+    def dead_letters(self):
+        """已放棄的 outbox 操作：(seq, op, memo id, 失敗次數)"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT seq, op, memo_id, attempts FROM outbox WHERE failed = 1 ORDER BY seq"
+            ).fetchall()
+
+    def mark_mirrored(self, items):
+        """items 為 (outbox seq, memo id) 的列表"""
+        with self.transaction():
+            self.conn.executemany("DELETE FROM outbox WHERE seq = ?", [(seq,) for seq, _ in items])
+            self.conn.executemany("UPDATE memos SET mirrored = 1 WHERE id = ?", [(memo_id,) for _, memo_id in items])
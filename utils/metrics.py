@@ -0,0 +1,166 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# 預設的延遲 bucket 上限 (秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+def _counter_name(name):
+    """Prometheus 慣例：counter 的名稱以 _total 結尾"""
+    return name if name.endswith('_total') else name + '_total'
+
+def _histogram_lines(name, labels, buckets, total):
+    """buckets 為 [(上限, 該 bucket 的次數)] (非累計)，最後一個 bucket 的上限必須是 inf"""
+    lines = []
+    cumulative = 0
+    for bound, count in buckets:
+        cumulative += count
+        le = "+Inf" if bound == float('inf') else repr(float(bound))
+        lines.append(f"{name}_bucket{_labels(dict(labels, le=le))} {cumulative}")
+    lines.append(f"{name}_sum{_labels(labels)} {float(total)}")
+    lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+    return lines
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = _counter_name(name)
+        self.help = help
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in self.values.items():
+                lines.append(f"{self.name}{_labels(dict(key))} {value}")
+        return lines
+
+class Gauge:
+    """值由 callback 在 scrape 時取得，平常沒有任何成本"""
+
+    def __init__(self, name, help, callback):
+        self.name = name
+        self.help = help
+        self.callback = callback
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self.callback()}"]
+
+class Histogram:
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0}
+            series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in self.series.items():
+                buckets = zip(self.buckets + (float('inf'),), series["counts"])
+                lines.extend(_histogram_lines(self.name, dict(key), buckets, series["sum"]))
+        return lines
+
+class Registry:
+    """最小的 Prometheus text format (0.0.4) registry
+
+    collectors 是在 scrape 時呼叫的函式，回傳 (name, type, help, [(labels dict, value)])，
+    用來匯出各模組既有的 stats dict，不必改動它們。type 為 histogram 時 value 是
+    {"buckets": [(上限, 次數)], "sum": 總和} (例如 LatencyHistogram.snapshot())，會展開成 _bucket/_sum/_count。
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help):
+        metric = Counter(name, help)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, callback):
+        metric = Gauge(name, help, callback)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logging.error(f"Failed to render metric {metric.name}: {e}")
+        for collector in self.collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                logging.error(f"Metrics collector failed: {e}")
+                continue
+            for name, kind, help, samples in families:
+                if kind == 'counter':
+                    name = _counter_name(name)
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    if kind == 'histogram':
+                        lines.extend(_histogram_lines(name, labels, value["buckets"], value["sum"]))
+                    else:
+                        lines.append(f"{name}{_labels(labels)} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+class RetryCounter(logging.Handler):
+    """retry 套件每次重試都會由 retry.api logger 記一筆 warning，以此計算重試次數"""
+
+    def __init__(self, counter):
+        super().__init__(level=logging.WARNING)
+        self.counter = counter
+
+    def emit(self, record):
+        error = record.args[0] if isinstance(record.args, tuple) and record.args else None
+        self.counter.inc(error=type(error).__name__ if error is not None else "unknown")
+
+registry = Registry()
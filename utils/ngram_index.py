@@ -0,0 +1,92 @@
+from collections import defaultdict
+
+class NgramIndex:
+    """字元 unigram + bigram 倒排索引，讓 `keyword in text` 不必逐列掃描
+
+    中文公司名稱 (富邦、摩根) 沒有空白斷詞，用字元 n-gram 最適合。
+    查詢時先取所有 bigram posting 的交集，再對少數候選做一次真正的子字串比對。
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(set)
+        self.texts = {}
+
+    @staticmethod
+    def _grams(text):
+        grams = set(text)
+        grams.update(text[i:i + 2] for i in range(len(text) - 1))
+        return grams
+
+    def add(self, doc_id, text):
+        self.remove(doc_id)
+        self.texts[doc_id] = text
+        for gram in self._grams(text):
+            self.postings[gram].add(doc_id)
+
+    def remove(self, doc_id):
+        text = self.texts.pop(doc_id, None)
+        if text is None:
+            return
+        for gram in self._grams(text):
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del self.postings[gram]
+
+    def search(self, keyword):
+        """回傳 text 內含 keyword 的所有 doc id"""
+        if not keyword:
+            return set(self.texts)
+        if len(keyword) == 1:
+            return set(self.postings.get(keyword, ()))
+
+        grams = sorted(
+            (self.postings.get(keyword[i:i + 2], set()) for i in range(len(keyword) - 1)),
+            key=len
+        )
+        candidates = set(grams[0])
+        for ids in grams[1:]:
+            candidates &= ids
+            if not candidates:
+                return candidates
+        return {doc_id for doc_id in candidates if keyword in self.texts[doc_id]}
+
+    def __len__(self):
+        return len(self.texts)
+
+class KeywordIndex:
+    """反向查詢：給一段文字，找出哪些已登記的 keyword 出現在其中 (NOT_FOUND 佔位資料用)"""
+
+    def __init__(self):
+        self.by_prefix = defaultdict(set)
+        self.keywords = {}
+
+    def add(self, doc_id, keyword):
+        self.remove(doc_id)
+        self.keywords[doc_id] = keyword
+        self.by_prefix[keyword[:2]].add(doc_id)
+
+    def remove(self, doc_id):
+        keyword = self.keywords.pop(doc_id, None)
+        if keyword is None:
+            return
+        ids = self.by_prefix[keyword[:2]]
+        ids.discard(doc_id)
+        if not ids:
+            del self.by_prefix[keyword[:2]]
+
+    def search(self, text):
+        """回傳 keyword 出現在 text 中的所有 doc id"""
+        prefixes = {''}
+        prefixes.update(text)
+        prefixes.update(text[i:i + 2] for i in range(len(text) - 1))
+        return {
+            doc_id
+            for prefix in prefixes if prefix in self.by_prefix
+            for doc_id in self.by_prefix[prefix]
+            if self.keywords[doc_id] in text
+        }
+
+    def __len__(self):
+        return len(self.keywords)
@@ -0,0 +1,68 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+class SamplingProfiler:
+    """統計式 profiler：每 interval 秒取樣一次各執行緒的 call stack，結束後寫成 collapsed stack 格式
+
+    輸出可直接交給 flamegraph.pl 或 speedscope。平常不會建立任何執行緒，沒有開啟時沒有額外成本；
+    同一時間只能有一個取樣在進行。
+    """
+
+    def __init__(self, directory='logs', thread_filter=None):
+        self.directory = directory
+        self.thread_filter = thread_filter or (lambda name: True)
+        self.lock = threading.Lock()
+        self.running = None
+
+    def start(self, seconds, interval=0.01):
+        """開始取樣 seconds 秒，回傳輸出檔路徑；已有取樣在進行時回傳 None"""
+        with self.lock:
+            if self.running is not None:
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+            self.running = threading.Thread(
+                target=self._sample, args=(path, seconds, interval), name="sampling-profiler", daemon=True
+            )
+            self.running.start()
+            return path
+
+    @staticmethod
+    def _frame_name(frame):
+        code = frame.f_code
+        return f"{code.co_name}@{os.path.basename(code.co_filename)}:{code.co_firstlineno}".replace(';', ':').replace(' ', '_')
+
+    def _sample(self, path, seconds, interval):
+        stacks = Counter()
+        samples = 0
+        me = threading.get_ident()
+        deadline = time.time() + seconds
+        try:
+            while time.time() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    name = names.get(ident, str(ident))
+                    if ident == me or not self.thread_filter(name):
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(self._frame_name(frame))
+                        frame = frame.f_back
+                    stack.append(name.replace(';', ':').replace(' ', '_'))
+                    stacks[";".join(reversed(stack))] += 1
+                samples += 1
+                time.sleep(interval)
+
+            with open(path, 'w', encoding='utf-8') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            logging.info(f"Profiler wrote {samples} samples ({len(stacks)} stacks) to {path}")
+        except Exception as e:
+            logging.error(f"Profiler failed: {e}")
+        finally:
+            with self.lock:
+                self.running = None
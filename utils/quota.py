@@ -0,0 +1,64 @@
+import threading
+import time
+
+# Google API 每分鐘的預設額度 (以單一使用者 / service account 的限制為準)，可在 [quota] 覆寫
+DEFAULT_QUOTAS = {
+    "sheets_read": 60,
+    "sheets_write": 60,
+    "drive_read": 600,
+    "drive_write": 600,
+}
+
+class TokenBucket:
+    """GCRA 形式的 token bucket：每個請求預約下一個可用的時間點，依到達順序平均分散送出
+
+    超過額度時呼叫端只會等到自己的時間點，不會先撞上 429 再 backoff。
+    """
+
+    def __init__(self, per_minute, burst=1):
+        self.interval = 60.0 / per_minute
+        self.tolerance = self.interval * (max(burst, 1) - 1)
+        self.tat = 0.0
+        self.lock = threading.Lock()
+        self.stats = {"acquired": 0, "waited": 0, "wait_seconds": 0.0}
+
+    def acquire(self, tokens=1):
+        with self.lock:
+            now = time.monotonic()
+            tat = max(self.tat, now)
+            # 一次取多個 token (例如一次 batch 多個請求) 要等到最後一個 token 也在額度內
+            wait = tat + self.interval * (tokens - 1) - self.tolerance - now
+            self.tat = tat + self.interval * tokens
+            self.stats["acquired"] += tokens
+            if wait > 0:
+                self.stats["waited"] += 1
+                self.stats["wait_seconds"] += wait
+        if wait > 0:
+            time.sleep(wait)
+        return max(wait, 0.0)
+
+class QuotaScheduler:
+    """Sheets / Drive 呼叫的集中限流，每個 API 類別一個 TokenBucket"""
+
+    def __init__(self, quotas=None, burst=5):
+        quotas = dict(DEFAULT_QUOTAS, **(quotas or {}))
+        self.buckets = {name: TokenBucket(per_minute, burst) for name, per_minute in quotas.items()}
+
+    @classmethod
+    def from_config(cls, config):
+        quotas = {
+            name: config.getint("quota", f"{name}_per_minute", fallback=default)
+            for name, default in DEFAULT_QUOTAS.items()
+        }
+        return cls(quotas, burst=config.getint("quota", 'burst', fallback=5))
+
+    def acquire(self, bucket, tokens=1):
+        return self.buckets[bucket].acquire(tokens)
+
+    def execute(self, bucket, request, **kwargs):
+        """取得 token 後才送出 googleapiclient 的 request"""
+        self.acquire(bucket)
+        return request.execute(**kwargs)
+
+    def snapshot(self):
+        return {name: dict(bucket.stats) for name, bucket in self.buckets.items()}
@@ -0,0 +1,54 @@
+import threading
+import time
+
+class MemoReadiness:
+    """檔案連結前的 readiness 判斷，取代 webhook 裡固定的 time.sleep(5)
+
+    使用者常常是「檔案 + 說明 memo」一起傳，檔案必須等 memo 先進佇列才能對應到正確的列。
+    如果 grace 秒內已經收到同一使用者的 memo 就立刻放行，
+    否則等到下一則 memo 進來 (事件觸發) 或 grace 到期為止。
+    """
+
+    def __init__(self, grace=5):
+        self.grace = grace
+        self.lock = threading.Lock()
+        self.last_memo = {}
+        self.waiting = {}
+
+    def memo_received(self, key):
+        with self.lock:
+            self.last_memo[key] = time.time()
+            waiters = self.waiting.pop(key, [])
+        for fire in waiters:
+            fire()
+
+    def when_ready(self, key, received_at, callback):
+        """received_at 為 webhook 收到檔案的時間 (time.time())，準備好時呼叫 callback"""
+        once = threading.Lock()
+
+        def fire():
+            if once.acquire(blocking=False):
+                timer.cancel()
+                self._discard(key, fire)
+                callback()
+
+        with self.lock:
+            last = self.last_memo.get(key)
+            remaining = received_at + self.grace - time.time()
+            ready = remaining <= 0 or (last is not None and last >= received_at - self.grace)
+            timer = threading.Timer(max(remaining, 0), fire)
+            timer.daemon = True
+            if not ready:
+                self.waiting.setdefault(key, []).append(fire)
+                timer.start()
+
+        if ready:
+            fire()
+
+    def _discard(self, key, fire):
+        with self.lock:
+            waiters = self.waiting.get(key)
+            if waiters and fire in waiters:
+                waiters.remove(fire)
+                if not waiters:
+                    del self.waiting[key]
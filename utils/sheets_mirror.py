@@ -0,0 +1,167 @@
+import logging
+import threading
+import time
+from retry import retry
+
+def _row_data(values):
+    return {"values": [{"userEnteredValue": {"stringValue": value}} for value in values]}
+
+class SheetsMirror(threading.Thread):
+    """把 MemoStore 的 outbox 以 row-level 差異寫回 Google Sheets (write-behind)
+
+    新資料插入在第二列 (標題列之下)，與原本 append_to_sheet 的排列方式相同。
+    一小段時間窗內累積的 memo 新增與 C 欄連結更新會合併成一次 batchUpdate 送出。
+    同一個操作連續失敗 max_attempts 次 (例如列已被刪除、range 錯誤) 就移到 dead letter，之後的操作繼續同步。
+    """
+
+    def __init__(self, store, sheets_service, spreadsheet_id, idle_interval=5, window=0.5, max_batch=100, quota=None,
+                 max_attempts=5):
+        super().__init__(daemon=True)
+        self.store = store
+        self.sheets_service = sheets_service
+        self.spreadsheet_id = spreadsheet_id
+        self.idle_interval = idle_interval
+        self.window = window
+        self.max_batch = max_batch
+        self.quota = quota
+        self.max_attempts = max_attempts
+        self.wakeup = threading.Event()
+        self.result_listeners = []
+        # 每次呼叫 Sheets API 後以 (request 名稱, 秒數) 通知
+        self.timing_listeners = []
+        self.stats = {"batches": 0, "items": 0, "failures": 0, "dead_letters": 0, "last_batch_size": 0, "last_flush_seconds": 0.0}
+        # stats 也會被 metrics collector 的執行緒讀取
+        self.stats_lock = threading.Lock()
+        self._sheet_gid = None
+        store.listeners.append(self.wakeup.set)
+
+    def bootstrap(self):
+        """本地儲存為空時，從 Sheets 讀一次現有資料 (只在第一次啟動時發生)"""
+        if not self.store.is_empty():
+            return
+        result = self._execute('sheets_read', 'values.get', self.sheets_service.spreadsheets().values().get(
+            spreadsheetId=self.spreadsheet_id,
+            range='A:C'
+        ))
+        values = result.get('values', [])
+        self.store.bootstrap(values[1:])
+        logging.info(f"Memo store bootstrapped with {len(values[1:])} rows from sheet")
+
+    @property
+    def sheet_gid(self):
+        if self._sheet_gid is None:
+            result = self._execute('sheets_read', 'get', self.sheets_service.spreadsheets().get(
+                spreadsheetId=self.spreadsheet_id,
+                fields='sheets.properties.sheetId'
+            ))
+            self._sheet_gid = result['sheets'][0]['properties']['sheetId']
+        return self._sheet_gid
+
+    def run(self):
+        while True:
+            self.wakeup.wait(timeout=self.idle_interval)
+            # 等待一個短暫的時間窗，讓同一波訊息合併成一批
+            time.sleep(self.window)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Failed to mirror memos to sheet: {e}")
+                time.sleep(self.idle_interval)
+
+    def flush(self):
+        while True:
+            ops = self.store.pending_ops(limit=self.max_batch)
+            if not ops:
+                return
+            start = time.time()
+            failure = None
+            try:
+                self._send(self._requests(ops))
+                done = ops
+            except Exception as e:
+                logging.error(f"Batch of {len(ops)} sheet updates failed, retrying one by one: {e}")
+                done, failure = self._send_one_by_one(ops)
+
+            self.store.mark_mirrored([(seq, memo_id) for seq, _, memo_id, _, _, _ in done])
+            elapsed = time.time() - start
+            with self.stats_lock:
+                self.stats["batches"] += 1
+                self.stats["items"] += len(done)
+                self.stats["last_batch_size"] = len(done)
+                self.stats["last_flush_seconds"] = elapsed
+            logging.info(f"Mirrored {len(done)} sheet updates in {elapsed:.3f}s")
+
+            for seq, op, memo_id, _, _, _ in done:
+                self._report(memo_id, op, True, None)
+            if failure:
+                (seq, op, memo_id, _, _, _), error = failure
+                gave_up = self.store.record_failure(seq, self.max_attempts)
+                with self.stats_lock:
+                    self.stats["failures"] += 1
+                    self.stats["dead_letters"] += int(gave_up)
+                self._report(memo_id, op, False, error)
+                if not gave_up:
+                    return
+                logging.error(f"Gave up mirroring {op} of memo {memo_id} after {self.max_attempts} attempts: {error}")
+
+    def _send_one_by_one(self, ops):
+        """整批失敗時逐筆送出，遇到第一筆失敗就停止以維持到達順序"""
+        done = []
+        for item in ops:
+            try:
+                self._send(self._requests(done + [item])[-self._request_count(item):])
+            except Exception as e:
+                return done, (item, e)
+            done.append(item)
+        return done, None
+
+    @staticmethod
+    def _request_count(item):
+        return 2 if item[1] == 'insert' else 1
+
+    def _execute(self, bucket, name, request):
+        """先向 quota 取得 token 再送出，timing_listeners 只計算 API 本身的耗時"""
+        if self.quota is not None:
+            self.quota.acquire(bucket)
+        start = time.time()
+        try:
+            return request.execute()
+        finally:
+            for listener in self.timing_listeners:
+                listener(name, time.time() - start)
+
+    def snapshot(self):
+        with self.stats_lock:
+            return dict(self.stats)
+
+    def _report(self, memo_id, op, ok, error):
+        for listener in self.result_listeners:
+            listener(memo_id, op, ok, error)
+
+    def _requests(self, ops):
+        """依序產生 batchUpdate 的 requests，row index 需考慮同批次中較早的 insert"""
+        gid = self.sheet_gid
+        requests = []
+        inserted = []
+        for _, op, memo_id, date, memo, link in ops:
+            index = self.store.sheet_row_index(memo_id) + sum(1 for other in inserted if other > memo_id)
+            if op == 'insert':
+                requests.append({"insertDimension": {
+                    "range": {"sheetId": gid, "dimension": "ROWS", "startIndex": index, "endIndex": index + 1},
+                    "inheritFromBefore": False
+                }})
+                inserted.append(memo_id)
+            requests.append({"updateCells": {
+                "start": {"sheetId": gid, "rowIndex": index, "columnIndex": 0},
+                "rows": [_row_data([date, memo, link])],
+                "fields": "userEnteredValue"
+            }})
+        return requests
+
+    @retry(tries=5, delay=2, backoff=2)
+    def _send(self, requests):
+        self._execute('sheets_write', 'batchUpdate', self.sheets_service.spreadsheets().batchUpdate(
+            spreadsheetId=self.spreadsheet_id,
+            body={"requests": requests}
+        ))
@@ -0,0 +1,45 @@
+import logging
+import queue
+import threading
+import zlib
+
+class PartitionedExecutor:
+    """依 key (LINE user_id) 分片的多執行緒任務佇列
+
+    同一個 key 的任務永遠落在同一個 worker，維持 memo 先、檔案後的順序；
+    不同使用者的任務則可以平行處理。
+    """
+
+    def __init__(self, workers):
+        self.queues = [queue.Queue() for _ in range(max(1, workers))]
+        self.threads = [
+            threading.Thread(target=self._work, args=(q,), name=f"task-worker-{i}", daemon=True)
+            for i, q in enumerate(self.queues)
+        ]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def partition(self, key):
+        return zlib.crc32((key or '').encode('utf-8')) % len(self.queues)
+
+    def submit(self, key, task):
+        self.queues[self.partition(key)].put(task)
+
+    def qsize(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def join(self):
+        for q in self.queues:
+            q.join()
+
+    def _work(self, task_queue):
+        while True:
+            task = task_queue.get()
+            try:
+                task()
+            except Exception as e:
+                logging.error(f"Task failed: {e}")
+            finally:
+                task_queue.task_done()
@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+import threading
+import time
+
+class TaskJournal:
+    """持久化的 append-only 任務日誌 (取代記憶體內的 queue.Queue)
+
+    每筆任務以一行 JSON 記錄 (kind, key, args)，完成後再寫入一行 ack。
+    寫入由背景執行緒以 group commit 的方式批次 fsync，
+    append() 會等到自己的那一批落盤後才回傳。
+    重新啟動時尚未 ack 的任務會由 replay() 取回。
+    seq 在重新啟動與清空日誌之後仍然遞增 (日誌開頭記錄 next_seq)，可以當作任務的唯一識別，
+    讓 handler 判斷任務是否已經套用過 (replay 是 at-least-once)。
+    """
+
+    def __init__(self, path, max_bytes=16 * 1024 * 1024):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.cond = threading.Condition()
+        self.buffer = []
+        self.outstanding, floor = self._load()
+        self.next_seq = max(max(self.outstanding, default=0) + 1, floor)
+        self.durable_seq = self.next_seq - 1
+        self._compact()
+
+        self.file = open(path, 'ab')
+        self.writer = threading.Thread(target=self._write_loop, name="task-journal", daemon=True)
+        self.writer.start()
+
+    def _load(self):
+        """回傳 (尚未 ack 的任務, 日誌記錄的 next_seq 下限)"""
+        outstanding = {}
+        floor = 1
+        if not os.path.exists(self.path):
+            return outstanding, floor
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 當機時最後一行可能只寫了一半
+                    logging.warning("Skipping torn record in task journal")
+                    continue
+                if 'ack' in record:
+                    outstanding.pop(record['ack'], None)
+                elif 'next_seq' in record:
+                    floor = max(floor, record['next_seq'])
+                else:
+                    outstanding[record['seq']] = record
+                    floor = max(floor, record['seq'] + 1)
+        return outstanding, floor
+
+    def _compact(self):
+        """只保留尚未 ack 的任務，以原子方式替換日誌檔"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self._encode({"next_seq": self.next_seq}))
+            for seq in sorted(self.outstanding):
+                f.write(self._encode(self.outstanding[seq]))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _encode(record):
+        return (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+    def replay(self):
+        """回傳上次執行時留下、尚未完成的任務 (依 seq 排序)"""
+        with self.cond:
+            return [self.outstanding[seq] for seq in sorted(self.outstanding)]
+
+    def append(self, kind, key, args):
+        with self.cond:
+            seq = self.next_seq
+            self.next_seq += 1
+            record = {"seq": seq, "kind": kind, "key": key, "args": args}
+            self.outstanding[seq] = record
+            self.buffer.append(self._encode(record))
+            self.cond.notify_all()
+            while self.durable_seq < seq:
+                self.cond.wait()
+        return seq
+
+    def ack(self, seq):
+        with self.cond:
+            self.outstanding.pop(seq, None)
+            self.buffer.append(self._encode({"ack": seq}))
+            self.cond.notify_all()
+
+    def pending(self):
+        with self.cond:
+            return len(self.outstanding)
+
+    def _write_loop(self):
+        while True:
+            with self.cond:
+                while not self.buffer:
+                    self.cond.wait()
+                lines, self.buffer = self.buffer, []
+                last_seq = self.next_seq - 1
+
+            try:
+                self.file.write(b''.join(lines))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            except Exception as e:
+                logging.error(f"Failed to write task journal: {e}")
+                with self.cond:
+                    self.buffer[:0] = lines
+                time.sleep(1)
+                continue
+
+            with self.cond:
+                self.durable_seq = last_seq
+                self.cond.notify_all()
+                # 沒有未完成的任務時直接清空日誌，避免檔案無限成長
+                if not self.outstanding and not self.buffer and self.file.tell() > self.max_bytes:
+                    self.file.truncate(0)
+                    # 清空後仍要留下 next_seq，重新啟動的 seq 才不會與已套用的任務重複
+                    self.file.write(self._encode({"next_seq": self.next_seq}))
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
@@ -0,0 +1,355 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+MANIFEST = 'manifest.json'
+TAIL = 'tail'
+TOMBSTONES = 'tombstones.bin'
+WRITER_LOCK = 'writer.lock'
+
+class VectorStore:
+    """memo 向量的磁碟儲存：不可變的 float32 segment + append-only 的 tail segment
+
+    每個 segment 是兩個檔案：<name>.f32 (count x dim 的 float32) 與 <name>.ids (int64 memo id)，
+    讀取時用 np.memmap 零複製對應，多個 process 共用同一份 page cache；啟動只讀 manifest，
+    與資料筆數無關。新向量寫入 tail，滿 seal_rows 筆就封存成新的 segment。
+
+    刪除以 tombstone (memo id, row 上限) 表示：該 id 在全域 row 編號小於上限的資料都視為刪除，
+    所以「先刪除再 append」就是更新。背景 compaction 會合併已封存的 segment 並丟掉已刪除的資料。
+    寫入 (append / delete / seal / compact) 以 writer.lock 檔案鎖在 process 之間互斥。
+    """
+
+    def __init__(self, directory, dim, seal_rows=50000):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dim = dim
+        self.seal_rows = seal_rows
+        self.lock = threading.RLock()
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        self._lock_file = open(os.path.join(directory, WRITER_LOCK), 'a')
+        self._maps = {}
+        self._manifest_mtime = None
+        self._tombstone_offset = 0
+        self._tombstone_inode = None
+        self.tombstones = {}
+
+        with self.writer():
+            if not os.path.exists(self._path(MANIFEST)):
+                self._write_manifest({"dim": dim, "segments": [], "tail_start_row": 0, "next_segment": 1})
+            self._load_manifest()
+            self._recover_tail()
+            self._load_tombstones()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def writer(self):
+        """寫入端的鎖 (同時對 thread 與其他 process 互斥)，取得後先同步其他 process 的變更"""
+        with self._write_lock:
+            if self._write_depth == 0:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+                if os.path.exists(self._path(MANIFEST)):
+                    self.refresh()
+            self._write_depth += 1
+            try:
+                yield
+            finally:
+                self._write_depth -= 1
+                if self._write_depth == 0:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _write_manifest(self, manifest):
+        tmp_path = self._path(MANIFEST + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path(MANIFEST))
+        self.manifest = manifest
+        self._manifest_mtime = os.stat(self._path(MANIFEST)).st_mtime_ns
+
+    def _load_manifest(self):
+        with open(self._path(MANIFEST), 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self._manifest_mtime = os.stat(self._path(MANIFEST)).st_mtime_ns
+        if self.manifest["dim"] != self.dim:
+            raise Exception(f"Vector store dim {self.manifest['dim']} does not match model dim {self.dim}")
+        # tail 可能已經被其他 process 封存，重新 mmap
+        live = {segment["file"] for segment in self.manifest["segments"]}
+        for name in list(self._maps):
+            if name not in live:
+                del self._maps[name]
+
+    def _recover_tail(self):
+        """封存到一半就當機時，把還沒寫進 manifest 的 segment 改回 tail；並截掉寫到一半的資料"""
+        orphan = f"seg-{self.manifest['next_segment']:06d}"
+        if os.path.exists(self._path(orphan + '.ids')) and not os.path.exists(self._path(TAIL + '.ids')):
+            os.replace(self._path(orphan + '.f32'), self._path(TAIL + '.f32'))
+            os.replace(self._path(orphan + '.ids'), self._path(TAIL + '.ids'))
+        for suffix in ('.f32', '.ids'):
+            open(self._path(TAIL + suffix), 'ab').close()
+
+        count = self._tail_count()
+        with open(self._path(TAIL + '.f32'), 'r+b') as f:
+            f.truncate(count * self.dim * 4)
+        with open(self._path(TAIL + '.ids'), 'r+b') as f:
+            f.truncate(count * 8)
+
+    def _tail_count(self):
+        try:
+            ids_count = os.path.getsize(self._path(TAIL + '.ids')) // 8
+            vec_count = os.path.getsize(self._path(TAIL + '.f32')) // (self.dim * 4)
+        except FileNotFoundError:
+            # 其他 process 正在封存 tail，下次 refresh 就會看到新的 segment
+            return 0
+        return min(ids_count, vec_count)
+
+    def _load_tombstones(self):
+        path = self._path(TOMBSTONES)
+        if not os.path.exists(path):
+            open(path, 'ab').close()
+        stat = os.stat(path)
+        size = stat.st_size
+        if stat.st_ino != self._tombstone_inode:
+            # compaction 重寫過 tombstone 檔
+            self.tombstones = {}
+            self._tombstone_offset = 0
+            self._tombstone_inode = stat.st_ino
+        if size == self._tombstone_offset:
+            return
+        with open(path, 'rb') as f:
+            f.seek(self._tombstone_offset)
+            data = np.frombuffer(f.read((size - self._tombstone_offset) // 16 * 16), dtype=np.int64).reshape(-1, 2)
+        for memo_id, bound in data.tolist():
+            self.tombstones[memo_id] = max(bound, self.tombstones.get(memo_id, 0))
+        self._tombstone_offset += data.nbytes
+
+    def refresh(self):
+        """其他 process 封存或 compaction 之後重新讀 manifest 與 tombstone"""
+        with self.lock:
+            if os.stat(self._path(MANIFEST)).st_mtime_ns != self._manifest_mtime:
+                self._load_manifest()
+            self._load_tombstones()
+
+    def _map(self, name, count):
+        cached = self._maps.get(name)
+        if cached is not None and len(cached[0]) == count:
+            return cached
+        if count == 0:
+            mapped = (np.zeros(0, dtype=np.int64), np.zeros((0, self.dim), dtype=np.float32))
+        else:
+            mapped = (
+                np.memmap(self._path(name + '.ids'), dtype=np.int64, mode='r', shape=(count,)),
+                np.memmap(self._path(name + '.f32'), dtype=np.float32, mode='r', shape=(count, self.dim)),
+            )
+        self._maps[name] = mapped
+        return mapped
+
+    def _segments(self):
+        """目前所有 segment 的 (ids, vectors, 起始 row 編號)，tail 在最後"""
+        segments = [
+            self._map(segment["file"], segment["count"]) + (segment["start_row"],)
+            for segment in self.manifest["segments"]
+        ]
+        segments.append(self._map(TAIL, self._tail_count()) + (self.manifest["tail_start_row"],))
+        return segments
+
+    def total_rows(self):
+        with self.lock:
+            return self.manifest["tail_start_row"] + self._tail_count()
+
+    def _sealed_max_id(self):
+        # 舊的 manifest 沒有 max_id，從各 segment 的 max_id 取最大值
+        return self.manifest.get("max_id", max((s["max_id"] for s in self.manifest["segments"]), default=0))
+
+    def max_id(self):
+        """寫入過的最大 memo id (更新會以較小的 id 重新 append，所以不能只看最後一筆)"""
+        with self.lock:
+            ids, _ = self._map(TAIL, self._tail_count())
+            return max(self._sealed_max_id(), int(ids.max()) if len(ids) else 0)
+
+    def meta(self, key, default=None):
+        """使用端記錄在 manifest 中的資料 (例如已經編碼到哪個 memo version)"""
+        self.refresh()
+        with self.lock:
+            return self.manifest.get("meta", {}).get(key, default)
+
+    def set_meta(self, key, value):
+        with self.writer(), self.lock:
+            self._write_manifest(dict(self.manifest, meta=dict(self.manifest.get("meta", {}), **{key: value})))
+
+    def append(self, ids, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        ids = np.ascontiguousarray(ids, dtype=np.int64)
+        with self.writer():
+            # 先寫向量再寫 id，id 檔的長度就是 commit 點
+            with open(self._path(TAIL + '.f32'), 'ab') as f:
+                f.write(vectors.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._path(TAIL + '.ids'), 'ab') as f:
+                f.write(ids.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            if self._tail_count() >= self.seal_rows:
+                self.seal()
+
+    def delete(self, ids):
+        with self.writer():
+            bound = self.total_rows()
+            data = np.array([[memo_id, bound] for memo_id in ids], dtype=np.int64)
+            with open(self._path(TOMBSTONES), 'ab') as f:
+                f.write(data.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self._load_tombstones()
+
+    def seal(self):
+        with self.writer(), self.lock:
+            count = self._tail_count()
+            if count == 0:
+                return
+            ids, _ = self._map(TAIL, count)
+            max_id = int(ids.max())
+            name = f"seg-{self.manifest['next_segment']:06d}"
+            self._maps.pop(TAIL, None)
+            os.replace(self._path(TAIL + '.f32'), self._path(name + '.f32'))
+            os.replace(self._path(TAIL + '.ids'), self._path(name + '.ids'))
+            manifest = dict(self.manifest)
+            manifest["segments"] = self.manifest["segments"] + [
+                {"file": name, "start_row": manifest["tail_start_row"], "count": count, "max_id": max_id}
+            ]
+            manifest["tail_start_row"] += count
+            manifest["next_segment"] += 1
+            manifest["max_id"] = max(self._sealed_max_id(), max_id)
+            self._write_manifest(manifest)
+            for suffix in ('.f32', '.ids'):
+                open(self._path(TAIL + suffix), 'ab').close()
+            logging.info(f"Sealed vector segment {name} with {count} rows")
+
+    def _live_mask(self, ids, start_row):
+        if not self.tombstones or len(ids) == 0:
+            return None
+        dead_ids = np.fromiter(self.tombstones, dtype=np.int64, count=len(self.tombstones))
+        positions = np.nonzero(np.isin(ids, dead_ids))[0]
+        if positions.size == 0:
+            return None
+        mask = np.ones(len(ids), dtype=bool)
+        for position in positions.tolist():
+            if start_row + position < self.tombstones[int(ids[position])]:
+                mask[position] = False
+        return mask
+
+    def _read_segments(self, attempts=3):
+        """查詢用的 segment 與 tombstone mask
+
+        其他 process compaction 後會刪掉舊的 segment 檔，手上的 manifest 若還是舊的，對應檔案時會找不到
+        (tail 剛被封存時則是檔案比記錄的短)；這時強制重新讀 manifest 再試。
+        """
+        for attempt in range(attempts):
+            self.refresh()
+            with self.lock:
+                try:
+                    segments = self._segments()
+                except (FileNotFoundError, ValueError) as e:
+                    if attempt == attempts - 1:
+                        raise
+                    logging.info(f"Vector segment changed while reading ({e}), reloading manifest")
+                    self._manifest_mtime = None
+                    continue
+                return segments, [self._live_mask(ids, start_row) for ids, _, start_row in segments]
+
+    def live_ids(self):
+        segments, masks = self._read_segments()
+        all_ids = [np.asarray(ids if mask is None else ids[mask]) for (ids, _, _), mask in zip(segments, masks)]
+        return np.concatenate(all_ids)
+
+    def scores(self, query_vector):
+        """回傳所有未刪除資料的 (memo ids, 內積分數)"""
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        segments, masks = self._read_segments()
+
+        all_ids, all_scores = [], []
+        for (ids, vectors, _), mask in zip(segments, masks):
+            if len(ids) == 0:
+                continue
+            scores = vectors @ query_vector
+            if mask is not None:
+                ids, scores = ids[mask], scores[mask]
+            all_ids.append(np.asarray(ids))
+            all_scores.append(scores)
+        if not all_ids:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return np.concatenate(all_ids), np.concatenate(all_scores)
+
+    def compact(self):
+        """合併所有已封存的 segment 並移除已刪除的資料；複製期間查詢照常進行，只有寫入會等待"""
+        with self.writer():
+            with self.lock:
+                snapshot = list(self.manifest["segments"])
+                if not snapshot:
+                    return
+                segments = [self._map(s["file"], s["count"]) + (s["start_row"],) for s in snapshot]
+                masks = [self._live_mask(ids, start_row) for ids, _, start_row in segments]
+            if len(snapshot) == 1 and masks[0] is None:
+                return
+            name = f"seg-{self.manifest['next_segment']:06d}"
+            snapshot_end = snapshot[-1]["start_row"] + snapshot[-1]["count"]
+
+            count = 0
+            with open(self._path(name + '.f32'), 'wb') as vec_file, open(self._path(name + '.ids'), 'wb') as ids_file:
+                for (ids, vectors, _), mask in zip(segments, masks):
+                    if mask is not None:
+                        ids, vectors = ids[mask], vectors[mask]
+                    vec_file.write(np.ascontiguousarray(vectors).tobytes())
+                    ids_file.write(np.ascontiguousarray(ids).tobytes())
+                    count += len(ids)
+                for f in (vec_file, ids_file):
+                    f.flush()
+                    os.fsync(f.fileno())
+
+            with self.lock:
+                # 合併後的 segment 沿用原本的起始 row 編號，存活的資料不會被剩下的 tombstone 誤刪
+                compacted = {"file": name, "start_row": snapshot[0]["start_row"], "count": count,
+                             "max_id": max(s["max_id"] for s in snapshot)}
+                self._write_manifest(dict(
+                    self.manifest, segments=[compacted], next_segment=self.manifest["next_segment"] + 1,
+                    max_id=self._sealed_max_id()
+                ))
+
+                # row 上限不超過已合併範圍的 tombstone 已經不會再影響任何資料
+                self.tombstones = {k: v for k, v in self.tombstones.items() if v > snapshot_end}
+                data = np.array(list(self.tombstones.items()), dtype=np.int64).reshape(-1, 2)
+                tmp_path = self._path(TOMBSTONES + '.tmp')
+                with open(tmp_path, 'wb') as f:
+                    f.write(data.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self._path(TOMBSTONES))
+                self._tombstone_offset = data.nbytes
+                self._tombstone_inode = os.stat(self._path(TOMBSTONES)).st_ino
+
+                # 其他 process 已經 mmap 的舊檔案在 unlink 之後仍然有效；還沒 mmap 的會在 _read_segments 重新讀 manifest
+                for segment in snapshot:
+                    self._maps.pop(segment["file"], None)
+                    for suffix in ('.f32', '.ids'):
+                        os.remove(self._path(segment["file"] + suffix))
+            logging.info(f"Compacted {len(snapshot)} vector segments into {name} ({count} rows)")
+
+    def start_compaction(self, interval=600):
+        def loop():
+            while not stop.wait(interval):
+                try:
+                    self.compact()
+                except Exception as e:
+                    logging.error(f"Vector store compaction failed: {e}")
+
+        stop = threading.Event()
+        threading.Thread(target=loop, name="vector-compaction", daemon=True).start()
+        return stop
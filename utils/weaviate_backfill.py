@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+import sys
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from weaviate.util import generate_uuid5
+from utils.memo_store import MemoStore, NOT_FOUND_PREFIX
+from utils.weaviate_op import config, logger, vdb, get_client, get_embedder
+
+class BackfillCheckpoint:
+    """記錄已匯入的最後一個 memo version，中斷後可從這裡繼續 (之後才補上內容的 memo 也會被匯入)"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        # 舊的 checkpoint 記錄的是 memo id，舊資料的初始 version 就是 id
+        return data.get("last_version", data.get("last_id", 0))
+
+    def save(self, last_version):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"last_version": last_version, "updated_at": time.time()}, f)
+        os.replace(tmp_path, self.path)
+
+def ensure_class(client, class_name):
+    if client.schema.exists(class_name):
+        return
+    client.schema.create_class({
+        "class": class_name,
+        "vectorizer": "none",
+        "properties": [
+            {"name": "uuid", "dataType": ["text"]},
+            {"name": "title", "dataType": ["text"]},
+            {"name": "content", "dataType": ["text"]},
+        ]
+    })
+
+def iter_batches(store, after_version, size):
+    """以 version 順序分批讀出新增或修改過的 memo，跳過 NOT_FOUND 佔位資料與空白 memo
+
+    每批回傳 (該批最後的 version, [(memo id, date, memo)])，被跳過的資料也會推進 version。
+    """
+    batch = []
+    version = yielded = after_version
+    for version, memo_id, date, memo in store.iter_changes(after_version):
+        if not memo.strip() or memo.startswith(NOT_FOUND_PREFIX):
+            continue
+        batch.append((memo_id, date, memo))
+        if len(batch) >= size:
+            yield version, batch
+            batch = []
+            yielded = version
+    if version != yielded:
+        yield version, batch
+
+def backfill(store, class_name, checkpoint, encode_batch=64, import_batch=256):
+    client = get_client()
+    model = get_embedder()
+    ensure_class(client, class_name)
+    client.batch.configure(batch_size=None)
+
+    last_version = checkpoint.load()
+    logger.info(f"Backfilling {class_name} from memo version {last_version}")
+    total = 0
+    start = time.time()
+
+    for version, batch in iter_batches(store, last_version, import_batch):
+        if not batch:
+            checkpoint.save(version)
+            continue
+        vectors = model.encode([memo for _, _, memo in batch], batch_size=encode_batch, show_progress_bar=False)
+        for (memo_id, date, memo), vector in zip(batch, vectors):
+            # 以 memo id 產生固定的 UUID，重跑或 memo 內容修改時會覆寫同一筆物件而不是重複新增
+            object_uuid = generate_uuid5(memo_id, class_name)
+            client.batch.add_data_object(
+                data_object={"uuid": object_uuid, "title": date, "content": memo},
+                class_name=class_name,
+                uuid=object_uuid,
+                vector=vector.tolist()
+            )
+        results = client.batch.create_objects()
+
+        errors = [r["result"]["errors"] for r in results or [] if r.get("result", {}).get("errors")]
+        if errors:
+            raise Exception(f"Weaviate batch import failed after memo version {last_version}: {errors[0]}")
+
+        last_version = version
+        checkpoint.save(last_version)
+        total += len(batch)
+        logger.info(f"Imported {total} memos ({total / (time.time() - start):.1f}/s), checkpoint at version {last_version}")
+
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description="把本地 memo 批次匯入 Weaviate")
+    parser.add_argument("--class-name", default=vdb)
+    parser.add_argument("--encode-batch", type=int, default=config.getint('Weaviate', 'encode_batch', fallback=64))
+    parser.add_argument("--import-batch", type=int, default=config.getint('Weaviate', 'import_batch', fallback=256))
+    parser.add_argument("--checkpoint", default=config.get('Weaviate', 'backfill_checkpoint', fallback='data/backfill.json'))
+    parser.add_argument("--restart", action="store_true", help="忽略 checkpoint 從頭開始")
+    args = parser.parse_args()
+
+    checkpoint = BackfillCheckpoint(args.checkpoint)
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    store = MemoStore(config.get("store", 'path'))
+    total = backfill(store, args.class_name, checkpoint, args.encode_batch, args.import_batch)
+    print(f"Imported {total} memos into {args.class_name}")
+
+if __name__ == "__main__":
+    main()
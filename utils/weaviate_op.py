@@ -73,22 +73,96 @@
 
 import weaviate
 from sentence_transformers import SentenceTransformer
-import sys, os
+import sys, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import utils.config_log as config_log
+from utils.embedding_cache import EmbeddingCache
+from utils.weaviate_query import hybrid_query, VECTOR_DECIMALS as DEFAULT_VECTOR_DECIMALS
 config, logger, CONFIG_PATH = config_log.setup_config_and_logging()
 config.read(CONFIG_PATH)
 
 wea_url = config.get('Weaviate', 'weaviate_url')
 vdb = config.get('Weaviate', 'classnm')
+# weaviate: 連線到 weaviate_url；local: 不需外部服務，直接在 process 內搜尋本地 memo
+backend = config.get('Weaviate', 'backend', fallback='weaviate')
 PROPERTIES = ["uuid", "title", "content"]
+MODEL_NAME = 'all-MiniLM-L6-v2'
+VECTOR_DECIMALS = config.getint('Weaviate', 'vector_decimals', fallback=DEFAULT_VECTOR_DECIMALS)
+
+# multi_search 可用名稱指定檢索模式
+RETRIEVAL_MODES = {"vector": 1.0, "hybrid": 0.5, "keyword": 0.0}
+RRF_K = 60
+
+# 整個 process 共用的 embedding 模型與 weaviate client，只載入一次
+_registry_lock = threading.Lock()
+_embedder = None
+_clients = {}
+_searchers = {}
+_search_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="search")
+registry_stats = {"model_load_seconds": None, "model_memory_bytes": None, "clients": 0}
+
+# 重複的查詢直接使用快取的向量，不必再跑一次模型
+query_cache = EmbeddingCache(
+    max_entries=config.getint('Weaviate', 'query_cache_size', fallback=1024),
+    ttl=config.getint('Weaviate', 'query_cache_ttl', fallback=86400),
+    path=config.get('Weaviate', 'query_cache_path', fallback='') or None
+)
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        with _registry_lock:
+            if _embedder is None:
+                start = time.time()
+                model = SentenceTransformer(MODEL_NAME)
+                # 先跑一次 encode 暖機，第一個真正的查詢才不會負擔初始化成本
+                model.encode("warm up")
+                registry_stats["model_load_seconds"] = time.time() - start
+                registry_stats["model_memory_bytes"] = sum(
+                    p.numel() * p.element_size() for p in model.parameters()
+                )
+                logger.info(f"Loaded {MODEL_NAME} in {registry_stats['model_load_seconds']:.2f}s, "
+                            f"{registry_stats['model_memory_bytes'] / 1024 / 1024:.1f} MB")
+                _embedder = model
+    return _embedder
+
+def get_client(url=None):
+    url = url or wea_url
+    with _registry_lock:
+        if url not in _clients:
+            _clients[url] = weaviate.Client(url=url)
+            registry_stats["clients"] = len(_clients)
+        return _clients[url]
+
+def warm_up():
+    """啟動時預先載入模型與 client"""
+    get_embedder()
+    if backend == 'weaviate':
+        get_client()
+    return dict(registry_stats)
+
+def get_searcher(classNm=None):
+    """依設定的 backend 回傳共用的搜尋物件"""
+    classNm = classNm or vdb
+    with _registry_lock:
+        searcher = _searchers.get((backend, classNm))
+    if searcher is None:
+        if backend == 'local':
+            from utils.local_search import LocalSemanticSearch
+            searcher = LocalSemanticSearch(classNm)
+        else:
+            searcher = WeaviateSemanticSearch(classNm)
+        with _registry_lock:
+            searcher = _searchers.setdefault((backend, classNm), searcher)
+    return searcher
 
 class WeaviateSemanticSearch:
     def __init__(self, classNm):
         self.url = wea_url
-        self.embeddings = SentenceTransformer('all-MiniLM-L6-v2')
-        self.client = weaviate.Client(url=wea_url)
+        self.embeddings = get_embedder()
+        self.client = get_client(wea_url)
         self.classNm = classNm
 
     def aggregate_count(self):
@@ -104,23 +178,12 @@ class WeaviateSemanticSearch:
     def delete_class(self):
         self.client.schema.delete_class(self.classNm)
 
-    def hybrid_search(self, query_text, num, alpha):
-        query_vector = self.embeddings.encode(query_text)
-        vector_str = ",".join(map(str, query_vector))
-        gql_query = f"""
-        {{
-            Get {{
-                {self.classNm}(hybrid: {{query: "{query_text}", vector: [{vector_str}], alpha: {alpha} }}, limit: {num}) {{
-                    content
-                    _additional {{
-                        distance
-                        score
-                    }}
-                }}
-            }}
-        }}
-        """
-        search_results = self.client.query.raw(gql_query)
+    def hybrid_search(self, query_text, num, alpha, query_vector=None):
+        if query_vector is None:
+            query_vector = query_cache.get_or_encode(query_text, self.embeddings.encode)
+        search_results = hybrid_query(
+            self.client.query.get(self.classNm, ["content"]), query_text, query_vector, alpha, num, VECTOR_DECIMALS
+        ).do()
 
         if 'errors' in search_results:
             raise Exception(search_results['errors'][0]['message'])
@@ -129,7 +192,7 @@ class WeaviateSemanticSearch:
         return results
 
 def search_do(input_, alp):
-    searcher = WeaviateSemanticSearch(vdb)
+    searcher = get_searcher(vdb)
     results = searcher.hybrid_search(input_, 3, alpha=alp)
 
     result_li = []
@@ -138,8 +201,38 @@ def search_do(input_, alp):
 
     return result_li
 
+def multi_search(input_, alphas=(1, 0.1), num=3, k=RRF_K):
+    """同一個查詢以多個 alpha (或 RETRIEVAL_MODES 的名稱) 同時搜尋，以 reciprocal rank fusion 合併
+
+    查詢只編碼一次；回傳去除重複後的排序結果，每筆附上在各模式中的名次與分數，以及各階段耗時 (秒)。
+    """
+    start = time.time()
+    searcher = get_searcher(vdb)
+    modes = [(str(alpha), RETRIEVAL_MODES.get(alpha, alpha)) for alpha in alphas]
+    query_vector = query_cache.get_or_encode(input_, searcher.embeddings.encode)
+    timings = {"encode": time.time() - start}
+
+    def run(alpha):
+        mode_start = time.time()
+        results = searcher.hybrid_search(input_, num, alpha=float(alpha), query_vector=query_vector)
+        return results, time.time() - mode_start
+
+    futures = [(mode, _search_pool.submit(run, alpha)) for mode, alpha in modes]
+    merged = {}
+    for mode, future in futures:
+        results, timings[mode] = future.result()
+        for rank, result in enumerate(results, 1):
+            entry = merged.setdefault(result['content'], {"content": result['content'], "score": 0.0, "modes": {}})
+            entry["score"] += 1 / (k + rank)
+            entry["modes"][mode] = {"rank": rank, "score": result['_additional'].get('score')}
+
+    timings["total"] = time.time() - start
+    ranked = sorted(merged.values(), key=lambda entry: entry["score"], reverse=True)
+    return {"results": ranked, "timings": timings}
+
 if __name__ == "__main__":
-    client = WeaviateSemanticSearch(vdb)
+    print(warm_up())
+    client = get_searcher(vdb)
 
     # 統計筆數
     count_result = client.aggregate_count()
@@ -156,4 +249,4 @@ if __name__ == "__main__":
     # An alpha of 0 is a pure keyword search
     quest = "老師 蔡炎龍 學生"
     with open("result.txt", 'w', encoding='utf-8') as file:
-        file.write(str(search_do(quest, alp=1)) + "\n\n\n" + str(search_do(quest, alp=0.1)))
+        file.write(str(multi_search(quest, alphas=(1, 0.1))))
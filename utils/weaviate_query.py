@@ -0,0 +1,18 @@
+import numpy as np
+
+# 不讀設定檔、不載入模型，weaviate_op 與 test/hybrid_query_bench.py 共用的查詢組裝
+# 查詢向量送出時保留的小數位數，6 位對 cosine 的影響遠小於 1e-5
+VECTOR_DECIMALS = 6
+
+def compact_vector(vector, decimals=VECTOR_DECIMALS):
+    """float32 向量轉成短小數的 list，避免 float64 的完整 repr 讓每個 request 膨脹"""
+    return np.round(np.asarray(vector, dtype=np.float64), decimals).tolist()
+
+def hybrid_query(builder, query_text, query_vector, alpha, num, decimals=VECTOR_DECIMALS):
+    """在 GetBuilder 上加上 hybrid 查詢；由 client 的 query builder 組 GraphQL，查詢文字中的引號等字元會被正確跳脫"""
+    return (
+        builder
+        .with_hybrid(query=query_text, vector=compact_vector(query_vector, decimals), alpha=alpha)
+        .with_additional(["distance", "score"])
+        .with_limit(num)
+    )